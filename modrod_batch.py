@@ -0,0 +1,133 @@
+"""Recursive scene decode/encode over whole directory trees."""
+import os
+import time
+from concurrent.futures import as_completed
+
+import modrod_c2di
+import modrod_cache
+import modrod_textures
+
+# c2ditools subcommand -> (input extension, output extension)
+SCENE_MODES = {
+    "scene_dec": (".oct", ".xml"),
+    "scene_enc": (".xml", ".oct"),
+}
+
+
+def find_scene_jobs(mode, input_dir, output_dir, files=None):
+    """Lists (input, output) pairs for every scene under input_dir, or for files if given.
+
+    Outputs mirror the input tree under output_dir with the extension swapped.
+    """
+    input_ext, output_ext = SCENE_MODES[mode]
+    if files is None:
+        files = []
+        for dirpath, dirnames, filenames in os.walk(input_dir):
+            dirnames.sort()
+            files.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+    jobs = []
+    for input_path in files:
+        if input_path.lower().endswith(input_ext):
+            relative = os.path.relpath(input_path, input_dir)
+            jobs.append((input_path, os.path.join(output_dir, os.path.splitext(relative)[0] + output_ext)))
+    return jobs
+
+
+def run_scene_job(mode, input_path, output_path, textures_dir):
+    """Runs one c2ditools scene conversion. Executed inside an engine worker."""
+    start = time.perf_counter()
+    error = None
+    returncode = None
+    usage = {}
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        returncode, output, usage = modrod_c2di.run_c2ditools_measured(
+            [mode, input_path, output_path, "-t", textures_dir])
+        if returncode != 0:
+            error = output.strip() or f"c2ditools exited with {returncode}"
+    except Exception as e:
+        error = str(e)
+    return {"input": input_path, "output": output_path, "error": error, "cached": None,
+            "seconds": time.perf_counter() - start, "returncode": returncode, "usage": usage}
+
+
+def default_textures_dir(mode, input_dir, output_dir):
+    return os.path.join(output_dir if mode == "scene_dec" else input_dir, "textures")
+
+
+def run_scene_batch(mode, input_dir, output_dir, textures_dir=None, on_result=None, cache=None,
+                    cancel_event=None, files=None):
+    """Converts every scene under input_dir across the c2ditools engine's workers.
+
+    A failing file is recorded in its result and does not stop the others.
+    Results are returned in input order; on_result, if given, is called as
+    on_result(result, done, total) as soon as each file finishes. With a
+    BuildCache, encodes whose inputs have not changed are skipped or restored
+    instead of re-run. Setting cancel_event drops every file not yet started.
+    files, e.g. from an AssetIndex query, replaces the walk of input_dir.
+    """
+    if textures_dir is None:
+        textures_dir = default_textures_dir(mode, input_dir, output_dir)
+    jobs = find_scene_jobs(mode, input_dir, output_dir, files)
+    print(f"Found {len(jobs)} scene(s) for {mode} under {input_dir}")
+    if not jobs:
+        return []
+    results = {}
+    keys = {}
+    if cache is not None and mode == "scene_enc":
+        cache.remember_hashes(modrod_textures.TextureStore().resolve(textures_dir))
+        tool_version = modrod_cache.c2ditools_version()
+        textures_hash = cache.directory_hash(textures_dir)
+        for input_path, output_path in jobs:
+            try:
+                keys[input_path] = cache.key(mode, input_path, tool_version, textures_hash)
+                cached = cache.restore(keys[input_path], output_path)
+            except OSError as e:
+                # A cache that cannot be read or restored from only costs a re-encode.
+                print(f"Build cache unavailable for {input_path}, encoding it: {e}")
+                cached = None
+            if cached is not None:
+                results[input_path] = {"input": input_path, "output": output_path, "error": None,
+                                       "cached": cached, "seconds": 0.0}
+                if on_result is not None:
+                    on_result(results[input_path], len(results), len(jobs))
+    engine = modrod_c2di.get_engine()
+    futures = {engine.submit(run_scene_job, mode, input_path, output_path, textures_dir): (input_path, output_path)
+               for input_path, output_path in jobs if input_path not in results}
+    for future in as_completed(futures):
+        if cancel_event is not None and cancel_event.is_set():
+            for pending in futures:
+                pending.cancel()
+        input_path, output_path = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            error = "cancelled" if future.cancelled() else f"worker failed: {e}"
+            result = {"input": input_path, "output": output_path, "error": error, "cached": None, "seconds": 0.0}
+        if input_path in keys and result["error"] is None:
+            try:
+                cache.store(keys[input_path], output_path)
+            except OSError as e:
+                print(f"Could not store {output_path} in the build cache: {e}")
+        results[input_path] = result
+        if on_result is not None:
+            on_result(result, len(results), len(jobs))
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"Could not save the build cache index: {e}")
+    return [results[input_path] for input_path, output_path in jobs]
+
+
+def format_results(results):
+    """Renders batch results as a plain-text table for output_text."""
+    lines = []
+    for result in results:
+        status = "FAILED" if result["error"] is not None else (result["cached"] or "OK").upper()
+        lines.append(f"{status:<9}{result['seconds']:>8.2f}s  {result['input']} -> {result['output']}")
+        if result["error"] is not None:
+            lines.append(f"           {result['error'].splitlines()[-1]}")
+    failed = sum(1 for result in results if result["error"] is not None)
+    lines.append(f"{len(results) - failed}/{len(results)} succeeded, {failed} failed")
+    return "\n".join(lines)
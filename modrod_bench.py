@@ -0,0 +1,347 @@
+"""Offline throughput benchmark with stand-in tools and a synthetic corpus.
+
+The harness writes a corpus of OCT, XML, JSON, Lua bytecode and texture
+files, puts stand-ins for c2ditools, java (unluac) and offsetting first on
+PYTHONPATH/PATH, and times each stage through the same modrod_ops calls
+the UI makes. Stand-ins sleep for a configurable latency and write
+outputs of a configurable size, so results measure this tool's overhead
+(process start-up, scheduling, caching, packing) rather than the real
+tools, and can be compared between runs.
+
+The report is JSON with files/sec, MB/sec and p50/p95 latency per stage.
+Latency is per call: per file for single-file stages, and the whole call
+for folder and pack stages.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import modrod_jobs
+
+STAGES = ("decode_oct", "encode_xml", "encode_xml_cached", "encode_json", "decrypt_lua", "decrypt_lua_folder",
+          "decode_folder", "pack_zip", "pack_zip_incremental")
+# Stages that measure a second pass need the first one to have run.
+PREREQUISITES = {"encode_xml_cached": "encode_xml", "pack_zip_incremental": "pack_zip"}
+TEXTURE_EXTENSION = ".dds"
+
+# One script plays every tool; the first argument says which. Latency and
+# output size come from the environment so spawned workers see them too.
+STANDIN_SOURCE = r'''
+import os
+import sys
+import threading
+import time
+
+LATENCY = float(os.environ.get("MODROD_STANDIN_LATENCY_MS", "0")) / 1000
+OUTPUT = int(os.environ.get("MODROD_STANDIN_OUTPUT_KB", "64")) * 1024
+
+
+def payload(seed):
+    line = (f"<!-- {seed} -->\n").encode("utf-8")
+    return (line * (OUTPUT // len(line) + 1))[:OUTPUT]
+
+
+def convert(src, dst):
+    with open(src, "rb") as f:
+        data = f.read()
+    time.sleep(LATENCY)
+    with open(dst, "wb") as f:
+        f.write(payload(len(data)))
+
+
+def c2ditools(args):
+    if len(args) < 5 or args[0] not in ("scene_dec", "scene_enc") or args[3] != "-t":
+        print("usage: c2ditools scene_dec|scene_enc INPUT OUTPUT -t TEXTURES", file=sys.stderr)
+        sys.exit(2)
+    if args[0] == "scene_dec":
+        os.makedirs(args[4], exist_ok=True)
+        with open(os.path.join(args[4], "shared.dds"), "wb") as f:
+            f.write(payload(0))
+    convert(args[1], args[2])
+
+
+def offsetting(args):
+    if args[:1] == ["--version"]:
+        print("offsetting stand-in")
+        return
+    convert(args[3], args[4])
+
+
+def unluac_worker():
+    print("READY", flush=True)
+    lock = threading.Lock()
+
+    def run(job_id, src, dst):
+        convert(src, dst)
+        with lock:
+            print(f"{job_id}\tOK", flush=True)
+
+    threads = []
+    for line in sys.stdin:
+        job_id, src, dst = line.rstrip("\n").split("\t")
+        thread = threading.Thread(target=run, args=(job_id, src, dst))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def java(args):
+    if args[:1] == ["-version"]:
+        print('openjdk version "stand-in"', file=sys.stderr)
+    elif args[:1] == ["-jar"]:
+        with open(args[2], "rb") as f:
+            size = len(f.read())
+        time.sleep(LATENCY)
+        sys.stdout.buffer.write(payload(size))
+    else:
+        unluac_worker()
+
+
+{"c2ditools": c2ditools, "offsetting": offsetting, "java": java}[sys.argv[1]](sys.argv[2:])
+'''
+
+
+class BenchJob(modrod_jobs.ConsoleJob):
+    """A ConsoleJob that keeps its log instead of printing it."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.lines = []
+
+    def log(self, text):
+        self.lines.append(text)
+
+
+def synthetic_bytes(rng, size, binary):
+    """Half random bytes and half repeated text, so compression has something to do."""
+    text = b"".join(rng.choice([b"mesh ", b"texture ", b"node ", b"material ", b"0.000 "]) for _ in range(64))
+    half = size // 2
+    noise = rng.randbytes(half) if binary else b""
+    return (noise + text * (size // len(text) + 1))[:size]
+
+
+def make_corpus(root, files=50, size_kb=64, seed=0):
+    """Writes files of each kind under root and returns {kind: [paths]}."""
+    rng = random.Random(seed)
+    size = size_kb * 1024
+    kinds = {
+        "oct": (".oct", b"OCT\x00", True),
+        "xml": (".xml", b"<?xml version='1.0'?>\n", False),
+        "json": (".json", b'{"data": "', False),
+        "lua": (".lua", b"\x1bLuaQ\x00", True),
+        "textures": (TEXTURE_EXTENSION, b"DDS ", True),
+    }
+    corpus = {}
+    for kind, (ext, header, binary) in kinds.items():
+        directory = os.path.join(root, kind)
+        os.makedirs(directory, exist_ok=True)
+        corpus[kind] = []
+        for i in range(files):
+            path = os.path.join(directory, f"asset_{i:05d}{ext}")
+            with open(path, "wb") as f:
+                f.write(header + synthetic_bytes(rng, size - len(header), binary))
+            corpus[kind].append(path)
+    return corpus
+
+
+def install_standins(workdir, latency_ms, output_kb):
+    """Puts the stand-in tools in front of the real ones and returns their paths."""
+    tools_dir = os.path.join(workdir, "standins")
+    package_dir = os.path.join(tools_dir, "c2ditools")
+    os.makedirs(package_dir, exist_ok=True)
+    script = os.path.join(tools_dir, "standin.py")
+    with open(script, "w", encoding="utf-8") as f:
+        f.write(STANDIN_SOURCE)
+    with open(os.path.join(package_dir, "__init__.py"), "w") as f:
+        f.write("")
+    with open(os.path.join(package_dir, "__main__.py"), "w") as f:
+        f.write(f"import sys, runpy\nsys.argv = [{script!r}, 'c2ditools'] + sys.argv[1:]\n"
+                f"runpy.run_path({script!r}, run_name='__main__')\n")
+    for tool in ("java", "offsetting"):
+        if os.name == "nt":
+            with open(os.path.join(tools_dir, tool + ".cmd"), "w") as f:
+                f.write(f'@"{sys.executable}" "{script}" {tool} %*\n')
+        else:
+            wrapper = os.path.join(tools_dir, tool)
+            with open(wrapper, "w") as f:
+                f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "$@"\n')
+            os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    unluac_path = os.path.join(tools_dir, "unluac.jar")
+    with open(unluac_path, "wb") as f:
+        f.write(b"stand-in")
+    os.environ["MODROD_STANDIN_LATENCY_MS"] = str(latency_ms)
+    os.environ["MODROD_STANDIN_OUTPUT_KB"] = str(output_kb)
+    os.environ["PATH"] = tools_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["PYTHONPATH"] = tools_dir + os.pathsep + os.environ.get("PYTHONPATH", "")
+    sys.path.insert(0, tools_dir)
+    offsetting = os.path.join(tools_dir, "offsetting.cmd" if os.name == "nt" else "offsetting")
+    return {"unluac": unluac_path, "offsetting": offsetting}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(files, bytes_in, seconds, latencies, failures):
+    return {
+        "files": files,
+        "bytes": bytes_in,
+        "seconds": round(seconds, 4),
+        "files_per_second": round(files / seconds, 2) if seconds else None,
+        "mb_per_second": round(bytes_in / (1024 * 1024) / seconds, 2) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "failures": failures,
+    }
+
+
+def time_each(paths, operation, concurrency=1):
+    """Runs operation(job, path) for every path and returns a stage summary."""
+
+    def timed(path):
+        start = time.perf_counter()
+        ok = operation(BenchJob(os.path.basename(path)), path)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, paths))
+    seconds = time.perf_counter() - start
+    return summarize(len(paths), sum(os.path.getsize(path) for path in paths), seconds,
+                     [latency for latency, ok in results], sum(1 for latency, ok in results if not ok))
+
+
+def time_once(paths, operation):
+    """Times a single call covering every path (folder and pack stages)."""
+    start = time.perf_counter()
+    ok = operation(BenchJob("bench"))
+    seconds = time.perf_counter() - start
+    return summarize(len(paths), sum(os.path.getsize(path) for path in paths), seconds, [seconds], 0 if ok else 1)
+
+
+def run_benchmark(files=50, size_kb=64, latency_ms=20, output_kb=64, stages=STAGES, concurrency=1, workdir=None,
+                  seed=0, log=print):
+    """Builds the corpus, runs the requested stages and returns the report dict."""
+    import modrod_c2di
+    import modrod_cache
+    import modrod_luacorpus
+    import modrod_ops
+    import modrod_trace
+    import modrod_zip
+
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="modrod_bench_")
+    saved_environ = dict(os.environ)
+    saved_path = list(sys.path)
+    # Keep benchmark runs out of the real job trace.
+    saved_tracer = modrod_trace.set_tracer(modrod_trace.Tracer(os.path.join(workdir, "trace.jsonl")))
+    engine = None
+    try:
+        corpus_dir = os.path.join(workdir, "corpus")
+        out_dir = os.path.join(workdir, "out")
+        corpus = make_corpus(corpus_dir, files, size_kb, seed)
+        tools = install_standins(workdir, latency_ms, output_kb)
+        engine = modrod_c2di.C2diEngine()
+        modrod_c2di.set_engine(engine)
+        textures = os.path.join(out_dir, "textures")
+        cache = modrod_cache.BuildCache(os.path.join(workdir, "cache"))
+        lua_corpus = modrod_luacorpus.LuaCorpus(os.path.join(workdir, "lua.sqlite"))
+        folder_lua_corpus = modrod_luacorpus.LuaCorpus(os.path.join(workdir, "lua_folder.sqlite"))
+
+        def output(path, ext, stage):
+            target = os.path.join(out_dir, stage, os.path.splitext(os.path.basename(path))[0] + ext)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            return target
+
+        def scratch_copy(kind, stage):
+            """Copies corpus[kind] to out/<stage>/ for stages that write beside their inputs."""
+            source = os.path.join(corpus_dir, kind)
+            target = os.path.join(out_dir, stage, kind)
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(source, target)
+            return target, [os.path.join(target, os.path.relpath(path, source)) for path in corpus[kind]]
+
+        def decrypt_lua():
+            # unluac writes .dec.lua files next to its inputs, which would end up in the pack stages.
+            folder, paths = scratch_copy("lua", "decrypt_lua")
+            return time_each(paths, lambda job, path: modrod_ops.decrypt_lua(job, tools["unluac"], path, lua_corpus),
+                             concurrency)
+
+        def decrypt_lua_folder():
+            folder, paths = scratch_copy("lua", "decrypt_lua_folder")
+            return time_once(paths, lambda job: modrod_ops.decrypt_lua_folder(job, tools["unluac"], folder,
+                                                                               corpus=folder_lua_corpus))
+
+        # Start the c2ditools workers up front so the first sample is not a pool start.
+        start = time.perf_counter()
+        modrod_ops.scene_decode(BenchJob("warm-up"), corpus["oct"][0], output(corpus["oct"][0], ".xml", "warmup"),
+                                textures)
+        warmup = time.perf_counter() - start
+
+        runs = {
+            "decode_oct": lambda: time_each(corpus["oct"], lambda job, path: modrod_ops.scene_decode(
+                job, path, output(path, ".xml", "decode_oct"), textures), concurrency),
+            "encode_xml": lambda: time_each(corpus["xml"], lambda job, path: modrod_ops.scene_encode(
+                job, path, output(path, ".oct", "encode_xml"), textures, cache), concurrency),
+            "encode_xml_cached": lambda: time_each(corpus["xml"], lambda job, path: modrod_ops.scene_encode(
+                job, path, output(path, ".oct", "encode_xml"), textures, cache), concurrency),
+            "encode_json": lambda: time_each(corpus["json"], lambda job, path: modrod_ops.offsetting_encode(
+                job, tools["offsetting"], path, output(path, ".oct", "encode_json"), cache), concurrency),
+            "decrypt_lua": decrypt_lua,
+            "decrypt_lua_folder": decrypt_lua_folder,
+            "decode_folder": lambda: time_once(corpus["oct"], lambda job: modrod_ops.scene_folder(
+                job, "scene_dec", os.path.join(corpus_dir, "oct"), os.path.join(out_dir, "decode_folder"))),
+            "pack_zip": lambda: time_once(corpus_files(), lambda job: modrod_ops.pack_zip(
+                job, corpus_dir, os.path.join(out_dir, "bench.zip"), incremental=False)),
+            "pack_zip_incremental": lambda: time_once(corpus_files(), touch_one_and_repack),
+        }
+
+        def corpus_files():
+            return [path for arcname, path in modrod_zip.list_files(corpus_dir)]
+
+        def touch_one_and_repack(job):
+            with open(corpus["xml"][0], "ab") as f:
+                f.write(b"\n")
+            return modrod_ops.pack_zip(job, corpus_dir, os.path.join(out_dir, "bench.zip"))
+
+        report = {
+            "config": {"files_per_kind": files, "size_kb": size_kb, "latency_ms": latency_ms, "output_kb": output_kb,
+                       "concurrency": concurrency, "seed": seed},
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+            "warmup_seconds": round(warmup, 4),
+            "stages": {},
+        }
+        for stage in stages:
+            if PREREQUISITES.get(stage) and PREREQUISITES[stage] not in stages:
+                runs[PREREQUISITES[stage]]()
+            log(f"Running {stage}...")
+            report["stages"][stage] = runs[stage]()
+        return report
+    finally:
+        # The unluac worker is closed by decompile_tree() itself.
+        if engine is not None:
+            engine.shutdown()
+            modrod_c2di.set_engine(None)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        sys.path[:] = saved_path
+        modrod_trace.set_tracer(saved_tracer)
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(report):
+    return json.dumps(report, indent=2)
@@ -0,0 +1,167 @@
+"""Runs c2ditools commands inside warm, long-lived worker processes.
+
+Spawning ``python -m c2ditools`` re-imports the whole library for every
+scene. Instead the command line is executed with runpy in a worker that
+imported c2ditools once at startup, which keeps the CLI as the only API we
+depend on. If c2ditools has no __main__ module, or a worker process dies,
+the command is re-run as a subprocess. A command that merely fails, argument
+errors included, is reported as it is: a fresh interpreter would fail the
+same way.
+"""
+import atexit
+import importlib.util
+import io
+import os
+import runpy
+import subprocess
+import sys
+import traceback
+from concurrent.futures import Future
+from contextlib import redirect_stderr, redirect_stdout
+
+import modrod_trace
+
+_engine = None
+
+
+def warm_up():
+    try:
+        import c2ditools
+    except ImportError:
+        pass
+
+
+def run_c2ditools_subprocess(args):
+    """Runs ``python -m c2ditools`` in a fresh interpreter, like the original tool did."""
+    result = subprocess.run([sys.executable, "-m", "c2ditools"] + list(args), capture_output=True, text=True)
+    return result.returncode, result.stdout + result.stderr
+
+
+def run_c2ditools(args):
+    """Runs a c2ditools command line in this interpreter and returns (returncode, output)."""
+    try:
+        if importlib.util.find_spec("c2ditools.__main__") is None:
+            return run_c2ditools_subprocess(args)
+    except ImportError:
+        return run_c2ditools_subprocess(args)
+    saved_argv = sys.argv
+    sys.argv = ["c2ditools"] + list(args)
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            runpy.run_module("c2ditools", run_name="__main__", alter_sys=True)
+        returncode = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            returncode = e.code or 0
+        else:
+            output.write(f"{e.code}\n")
+            returncode = 1
+    except Exception:
+        output.write(traceback.format_exc())
+        returncode = 1
+    finally:
+        sys.argv = saved_argv
+    return returncode, output.getvalue()
+
+
+def run_c2ditools_measured(args):
+    """run_c2ditools() plus the resource usage of the process that ran it."""
+    (returncode, output), usage = modrod_trace.measure(run_c2ditools, args)
+    return returncode, output, usage
+
+
+class C2diEngine:
+    """A pool of worker processes that have c2ditools imported and ready."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def _discard_pool(self, pool):
+        """Drops a broken pool, shutting it down so its surviving workers exit."""
+        if self.pool is pool:
+            self.pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) in a warm worker, replacing the pool if a worker died."""
+        from concurrent.futures.process import BrokenProcessPool
+        pool = self._get_pool()
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            return self._get_pool().submit(fn, *args)
+
+    def run(self, args):
+        """Runs a c2ditools command line and returns (returncode, output)."""
+        returncode, output, usage = self.run_measured(args)
+        return returncode, output
+
+    def run_measured(self, args):
+        """Like run(), plus the worker's resource usage (see modrod_trace.measure)."""
+        from concurrent.futures.process import BrokenProcessPool
+        pool = None
+        try:
+            future = self.submit(run_c2ditools_measured, list(args))
+            pool = self.pool
+            return future.result()
+        except BrokenProcessPool:
+            self._discard_pool(pool or self.pool)
+            (returncode, output), usage = modrod_trace.measure(run_c2ditools_subprocess, args)
+            return returncode, output, usage
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+class InlineEngine:
+    """Runs everything in the calling process.
+
+    Used for one-shot command line runs, where starting a worker would cost
+    more than it saves.
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, args):
+        return run_c2ditools(args)
+
+    def run_measured(self, args):
+        return run_c2ditools_measured(args)
+
+    def shutdown(self):
+        pass
+
+
+def set_engine(engine):
+    """Replaces the shared engine returned by get_engine()."""
+    global _engine
+    _engine = engine
+
+
+def get_engine():
+    """Returns the shared engine, starting it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = C2diEngine()
+        atexit.register(_engine.shutdown)
+    return _engine
@@ -0,0 +1,146 @@
+"""Content-hash build cache for XML->OCT and JSON->OCT encoding.
+
+An encode is keyed by the hash of its input file, every file in its textures
+directory and the version of the tool doing the work. Encoded outputs are
+stored once under their own hash, so an unchanged asset is either skipped
+(the output on disk already matches) or copied back out of the cache.
+"""
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import shutil
+import threading
+
+DEFAULT_CACHE_DIR = ".modrod_cache"
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def c2ditools_version():
+    try:
+        return "c2ditools " + importlib.metadata.version("c2ditools")
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    # Installed straight from git the distribution name is not reliable, so
+    # fall back to the newest source file in the package.
+    spec = importlib.util.find_spec("c2ditools")
+    if spec is None or not spec.submodule_search_locations:
+        return "c2ditools missing"
+    package_dir = list(spec.submodule_search_locations)[0]
+    newest = 0
+    for dirpath, dirnames, filenames in os.walk(package_dir):
+        for filename in filenames:
+            if filename.endswith(".py"):
+                newest = max(newest, os.stat(os.path.join(dirpath, filename)).st_mtime_ns)
+    return f"c2ditools {package_dir} {newest}"
+
+
+def executable_version(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return f"{path} missing"
+    return f"{os.path.abspath(path)} {st.st_size} {st.st_mtime_ns}"
+
+
+class BuildCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.entries = {}
+        self.file_hashes = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                self.entries = index.get("entries", {})
+                self.file_hashes = index.get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable build cache index {self.index_path}: {e}")
+
+    def file_hash(self, path):
+        """Hashes path, reusing the last hash while its size and mtime are unchanged."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        known = self.file_hashes.get(path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        digest = hash_file(path)
+        self.file_hashes[path] = [st.st_size, st.st_mtime_ns, digest]
+        self.dirty = True
+        return digest
+
+    def remember_hashes(self, hashes):
+        """Adds known {path: [size, mtime_ns, sha256]} hashes, e.g. from TextureStore.resolve()."""
+        for path, known in hashes.items():
+            if self.file_hashes.get(path) != known:
+                self.file_hashes[path] = known
+                self.dirty = True
+
+    def directory_hash(self, directory):
+        digest = hashlib.sha256()
+        if directory and os.path.isdir(directory):
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    path = os.path.join(dirpath, filename)
+                    digest.update(os.path.relpath(path, directory).replace(os.sep, "/").encode("utf-8"))
+                    digest.update(self.file_hash(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def key(self, operation, input_path, tool_version, textures_hash=""):
+        """Builds the cache key; pass directory_hash() of the textures as textures_hash."""
+        parts = [operation, self.file_hash(input_path), textures_hash, tool_version]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    def restore(self, key, output_path):
+        """Brings output_path up to date from the cache.
+
+        Returns "skipped" when it already matched, "restored" when it was
+        copied from the cache, or None on a miss.
+        """
+        digest = self.entries.get(key)
+        if digest is None or not os.path.exists(self.object_path(digest)):
+            return None
+        if os.path.exists(output_path) and self.file_hash(output_path) == digest:
+            return "skipped"
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        shutil.copyfile(self.object_path(digest), output_path)
+        st = os.stat(output_path)
+        self.file_hashes[os.path.abspath(output_path)] = [st.st_size, st.st_mtime_ns, digest]
+        self.dirty = True
+        return "restored"
+
+    def store(self, key, output_path):
+        digest = self.file_hash(output_path)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            shutil.copyfile(output_path, object_path + ".tmp")
+            os.replace(object_path + ".tmp", object_path)
+        self.entries[key] = digest
+        self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump({"entries": dict(self.entries), "files": dict(self.file_hashes)}, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
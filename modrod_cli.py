@@ -0,0 +1,320 @@
+"""Headless command line for Octane-Mod-Rod.
+
+    python octane_modrod.py decode INPUT OUTPUT [-t TEXTURES] [--select QUERY] [--dedupe-textures]
+    python octane_modrod.py encode INPUT OUTPUT [-t TEXTURES] [--no-cache] [--select QUERY]
+    python octane_modrod.py pack FOLDER OUTPUT_ZIP [--c2ditools] [--full]
+    python octane_modrod.py build RECIPE [--offsetting EXE]
+    python octane_modrod.py decrypt INPUT [--unluac JAR] [--select QUERY]
+    python octane_modrod.py watch WORKSPACE [-o OUTPUT] [-t TEXTURES] [--zip OUTPUT_ZIP [--pack-folder FOLDER]]
+    python octane_modrod.py search QUERY [--root FOLDER] [--limit N]
+    python octane_modrod.py index scan ROOT
+    python octane_modrod.py index query ROOT QUERY
+    python octane_modrod.py offsetting decode|encode INPUT [OUTPUT] [--offsetting EXE]
+    python octane_modrod.py dct unpack INPUT OUTPUT [--only GLOB ...] [--decode] [--decrypt]
+    python octane_modrod.py dct pack INPUT OUTPUT
+    python octane_modrod.py bench [--files N] [--latency-ms MS] [--output FILE] ...
+    python octane_modrod.py stats [--top N]
+
+INPUT may be a single file or a folder; folders are converted recursively
+into OUTPUT, and --select narrows a folder down to the assets matching an
+index query such as "under=levels/ min_size=1MB". Tool paths default to
+the ones saved by the setup screen in config.txt. Only the modules a
+subcommand needs are imported.
+"""
+import argparse
+import os
+import sys
+
+
+_console_jobs = []
+
+
+def console_job(name):
+    import modrod_jobs
+    job = modrod_jobs.ConsoleJob(name)
+    _console_jobs.append(job)
+    return job
+
+
+def use_inline_c2ditools():
+    # A single conversion is faster in this process than in a fresh worker.
+    import modrod_c2di
+    modrod_c2di.set_engine(modrod_c2di.InlineEngine())
+
+
+def build_cache(args):
+    if args.no_cache:
+        return None
+    import modrod_cache
+    return modrod_cache.BuildCache()
+
+
+def configured_path(value, key):
+    if value:
+        return value
+    import modrod_ops
+    return modrod_ops.read_config().get(key, "")
+
+
+def cmd_decode(args):
+    import modrod_ops
+    texture_store = None
+    if args.dedupe_textures:
+        import modrod_textures
+        texture_store = modrod_textures.TextureStore()
+    if os.path.isdir(args.input):
+        return modrod_ops.scene_folder(console_job("decode"), "scene_dec", args.input, args.output, args.textures,
+                                       query=args.select, texture_store=texture_store)
+    use_inline_c2ditools()
+    textures = args.textures or os.path.join(os.path.dirname(os.path.abspath(args.output)), "textures")
+    return modrod_ops.scene_decode(console_job("decode"), args.input, args.output, textures, texture_store)
+
+
+def cmd_encode(args):
+    import modrod_ops
+    cache = build_cache(args)
+    if os.path.isdir(args.input):
+        return modrod_ops.scene_folder(console_job("encode"), "scene_enc", args.input, args.output, args.textures,
+                                       cache, args.select)
+    use_inline_c2ditools()
+    textures = args.textures or os.path.join(os.path.dirname(os.path.abspath(args.input)), "textures")
+    return modrod_ops.scene_encode(console_job("encode"), args.input, args.output, textures, cache)
+
+
+def cmd_pack(args):
+    import modrod_ops
+    if args.c2ditools:
+        use_inline_c2ditools()
+    output_zip = args.output if args.output.lower().endswith(".zip") else f"{args.output}.zip"
+    return modrod_ops.pack_zip(console_job("pack"), args.input, output_zip, args.c2ditools, not args.full)
+
+
+def cmd_build(args):
+    import modrod_ops
+    offsetting_path = configured_path(args.offsetting, "offsetting_path")
+    return modrod_ops.build_recipe(console_job("build"), args.recipe, offsetting_path)
+
+
+def cmd_decrypt(args):
+    import modrod_ops
+    unluac_path = configured_path(args.unluac, "unluac_path")
+    if not os.path.exists(unluac_path):
+        print(f"unluac.jar not found at {unluac_path!r}; pass --unluac or run setup", file=sys.stderr)
+        return False
+    if os.path.isdir(args.input):
+        return modrod_ops.decrypt_lua_folder(console_job("decrypt"), unluac_path, args.input, args.select)
+    return modrod_ops.decrypt_lua(console_job("decrypt"), unluac_path, args.input)
+
+
+def cmd_watch(args):
+    import modrod_ops
+    if not os.path.isdir(args.workspace):
+        print(f"{args.workspace!r} is not a folder", file=sys.stderr)
+        return False
+    offsetting_path = configured_path(args.offsetting, "offsetting_path")
+    output_zip = args.zip
+    if output_zip and not output_zip.lower().endswith(".zip"):
+        output_zip += ".zip"
+    print("Press Ctrl+C to stop watching.")
+    return modrod_ops.watch_workspace(console_job("watch"), args.workspace, offsetting_path, args.output,
+                                      args.textures, build_cache(args), output_zip, args.pack_folder)
+
+
+def cmd_search(args):
+    import modrod_ops
+    return modrod_ops.lua_search(console_job("search"), args.query, args.root, args.limit)
+
+
+def cmd_index(args):
+    import modrod_ops
+    if args.action == "scan":
+        return modrod_ops.index_scan(console_job("index"), args.root)
+    if not args.query:
+        print("index query needs a QUERY, e.g. \"type=oct under=levels/\"", file=sys.stderr)
+        return False
+    files = modrod_ops.index_select(console_job("index"), args.root, args.query)
+    if files is None:
+        return False
+    for path in files:
+        print(path)
+    return True
+
+
+def cmd_offsetting(args):
+    import modrod_ops
+    offsetting_path = configured_path(args.offsetting, "offsetting_path")
+    if not os.path.exists(offsetting_path):
+        print(f"offsetting not found at {offsetting_path!r}; pass --offsetting or run setup", file=sys.stderr)
+        return False
+    if args.action == "decode":
+        return modrod_ops.offsetting_decode(console_job("offsetting decode"), offsetting_path, args.input, args.output)
+    return modrod_ops.offsetting_encode(console_job("offsetting encode"), offsetting_path, args.input, args.output,
+                                       build_cache(args))
+
+
+def cmd_dct(args):
+    import modrod_ops
+    offsetting_path = configured_path(args.offsetting, "offsetting_path")
+    if not os.path.exists(offsetting_path):
+        print(f"offsetting not found at {offsetting_path!r}; pass --offsetting or run setup", file=sys.stderr)
+        return False
+    if args.action == "pack":
+        return modrod_ops.dct_pack(console_job("dct pack"), offsetting_path, args.input, args.output)
+    unluac_path = None
+    if args.decrypt:
+        unluac_path = configured_path(args.unluac, "unluac_path")
+        if not os.path.exists(unluac_path):
+            print(f"unluac.jar not found at {unluac_path!r}; pass --unluac or run setup", file=sys.stderr)
+            return False
+    return modrod_ops.dct_unpack(console_job("dct unpack"), offsetting_path, args.input, args.output, args.only,
+                                 args.decode, unluac_path)
+
+
+def cmd_bench(args):
+    import modrod_bench
+    stages = args.stages.split(",") if args.stages else modrod_bench.STAGES
+    unknown = [stage for stage in stages if stage not in modrod_bench.STAGES]
+    if unknown:
+        print(f"Unknown stage(s) {', '.join(unknown)}; choose from {', '.join(modrod_bench.STAGES)}", file=sys.stderr)
+        return False
+    report = modrod_bench.run_benchmark(args.files, args.size_kb, args.latency_ms, args.output_kb, stages,
+                                        args.concurrency, args.workdir, args.seed,
+                                        log=lambda text: print(text, file=sys.stderr))
+    text = modrod_bench.format_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return all(stage["failures"] == 0 for stage in report["stages"].values())
+
+
+def cmd_stats(args):
+    import modrod_trace
+    tracer = modrod_trace.Tracer(args.trace) if args.trace else modrod_trace.get_tracer()
+    records = tracer.read()
+    if not records:
+        print(f"No trace records in {tracer.path}", file=sys.stderr)
+        return False
+    print(modrod_trace.format_summary(modrod_trace.summarize(records, args.top)))
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="octane_modrod", description="Octane Engine modding tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    decode = commands.add_parser("decode", help="decode OCT scenes to XML with c2ditools")
+    decode.add_argument("input", help="OCT file or folder")
+    decode.add_argument("output", help="XML file or folder")
+    decode.add_argument("-t", "--textures", help="textures directory")
+    decode.add_argument("--select", metavar="QUERY", help="only the indexed assets matching QUERY")
+    decode.add_argument("--dedupe-textures", action="store_true",
+                        help="store each texture once and link the textures directory to it")
+    decode.set_defaults(handler=cmd_decode)
+
+    encode = commands.add_parser("encode", help="encode XML scenes to OCT with c2ditools")
+    encode.add_argument("input", help="XML file or folder")
+    encode.add_argument("output", help="OCT file or folder")
+    encode.add_argument("-t", "--textures", help="textures directory")
+    encode.add_argument("--no-cache", action="store_true", help="always re-encode")
+    encode.add_argument("--select", metavar="QUERY", help="only the indexed assets matching QUERY")
+    encode.set_defaults(handler=cmd_encode)
+
+    pack = commands.add_parser("pack", help="pack a folder into a mod .zip")
+    pack.add_argument("input", help="folder to pack")
+    pack.add_argument("output", help="output archive name")
+    pack.add_argument("--c2ditools", action="store_true", help="pack with c2ditools why instead of the native packer")
+    pack.add_argument("--full", action="store_true", help="rebuild the archive instead of updating it")
+    pack.set_defaults(handler=cmd_pack)
+
+    build = commands.add_parser("build", help="decode, patch, encode and pack a mod from a recipe")
+    build.add_argument("recipe", help="build recipe (.json)")
+    build.add_argument("--offsetting", help="path to the offsetting executable")
+    build.set_defaults(handler=cmd_build)
+
+    decrypt = commands.add_parser("decrypt", help="decompile .lua bytecode with unluac")
+    decrypt.add_argument("input", help=".lua file or folder")
+    decrypt.add_argument("--unluac", help="path to unluac.jar")
+    decrypt.add_argument("--select", metavar="QUERY", help="only the indexed assets matching QUERY")
+    decrypt.set_defaults(handler=cmd_decrypt)
+
+    search = commands.add_parser("search", help="search the scripts decompiled so far")
+    search.add_argument("query", help='words, fn:NAME, str:"TEXT", prefix*, under:FOLDER')
+    search.add_argument("--root", help="only scripts under this folder")
+    search.add_argument("--limit", type=int, default=50, help="most matches to list (default 50)")
+    search.set_defaults(handler=cmd_search)
+
+    watch = commands.add_parser("watch", help="re-encode .xml and .json files under a folder whenever they are saved")
+    watch.add_argument("workspace", help="folder to watch")
+    watch.add_argument("-o", "--output", help="write .oct files into this tree instead of next to the sources")
+    watch.add_argument("-t", "--textures", help="textures directory for XML scenes")
+    watch.add_argument("--zip", help="repack this archive after every change")
+    watch.add_argument("--pack-folder", help="folder packed into --zip (default the output or workspace)")
+    watch.add_argument("--offsetting", help="path to the offsetting executable")
+    watch.add_argument("--no-cache", action="store_true", help="always re-encode")
+    watch.set_defaults(handler=cmd_watch)
+
+    index = commands.add_parser("index", help="index a game install for fast asset queries")
+    index.add_argument("action", choices=["scan", "query"])
+    index.add_argument("root", help="game install or extracted archive")
+    index.add_argument("query", nargs="?", help='filters, e.g. "type=oct under=levels/ min_size=1MB name=*.oct"')
+    index.set_defaults(handler=cmd_index)
+
+    offsetting = commands.add_parser("offsetting", help="convert OCT files with offsetting")
+    offsetting.add_argument("action", choices=["decode", "encode"])
+    offsetting.add_argument("input", help="OCT or JSON file")
+    offsetting.add_argument("output", nargs="?", help="defaults to the input with its extension swapped")
+    offsetting.add_argument("--offsetting", help="path to the offsetting executable")
+    offsetting.add_argument("--no-cache", action="store_true", help="always re-encode")
+    offsetting.set_defaults(handler=cmd_offsetting)
+
+    dct = commands.add_parser("dct", help="unpack or repack DCT archives with offsetting")
+    dct.add_argument("action", choices=["unpack", "pack"])
+    dct.add_argument("input", help=".dct archive or folder of them (unpack), *.dct folder or folder of them (pack)")
+    dct.add_argument("output", help="output folder")
+    dct.add_argument("--only", metavar="GLOB", action="append",
+                     help="keep only members matching GLOB (path or file name); repeatable")
+    dct.add_argument("--decode", action="store_true", help="decode the extracted .oct files to JSON")
+    dct.add_argument("--decrypt", action="store_true", help="decompile the extracted .lua files")
+    dct.add_argument("--unluac", help="path to unluac.jar")
+    dct.add_argument("--offsetting", help="path to the offsetting executable")
+    dct.set_defaults(handler=cmd_dct)
+
+    bench = commands.add_parser("bench", help="measure throughput against stand-in tools and a synthetic corpus")
+    bench.add_argument("--files", type=int, default=50, help="files of each kind in the corpus (default 50)")
+    bench.add_argument("--size-kb", type=int, default=64, help="size of each corpus file (default 64)")
+    bench.add_argument("--latency-ms", type=float, default=20, help="stand-in tool latency per file (default 20)")
+    bench.add_argument("--output-kb", type=int, default=64, help="stand-in tool output size (default 64)")
+    bench.add_argument("--concurrency", type=int, default=1, help="parallel calls in single-file stages")
+    bench.add_argument("--stages", help="comma-separated subset of the stages to run")
+    bench.add_argument("--workdir", help="keep the corpus and outputs here instead of a temp directory")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--output", help="also write the JSON report to this file")
+    bench.set_defaults(handler=cmd_bench)
+
+    stats = commands.add_parser("stats", help="show the slowest files and per-stage totals from the job trace")
+    stats.add_argument("--top", type=int, default=10, help="how many of the slowest files to list (default 10)")
+    stats.add_argument("--trace", help="trace file to read instead of .modrod_cache/trace.jsonl")
+    stats.set_defaults(handler=cmd_stats)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    status = "failed"
+    try:
+        ok = args.handler(args)
+        status = "done" if ok else "failed"
+        return 0 if ok else 1
+    except KeyboardInterrupt:
+        status = "cancelled"
+        return 130
+    finally:
+        if _console_jobs:
+            import modrod_trace
+            for job in _console_jobs:
+                modrod_trace.record_job(job, status)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""DCT archive unpack and repack through offsetting, many archives at a time.
+
+    offsetting dct unpack ARCHIVE FOLDER
+    offsetting dct pack FOLDER ARCHIVE
+
+An archive levels/track.dct under the input folder is unpacked to the
+folder levels/track_dct/ under the output folder, and pack turns every
+folder named *_dct back into an archive at the same relative path, so the
+two round-trip, also when unpacking in place beside the archives.
+Archives are independent and offsetting is single threaded, so they are
+processed concurrently.
+
+offsetting has no way to extract single members. For a selective unpack
+the archive is unpacked into a temp folder beside the target, on the same
+drive, and only the members matching the globs are moved into place; the
+rest is deleted straight away.
+
+Decoding and decompiling leave x.json beside x.oct and x.dec.lua beside
+x.lua. Unpacking lists the archive's members in a .modrod_members file in
+the folder, and pack leaves out files named like those outputs that were
+not members, together with the list itself, by packing a staging folder
+of hardlinks to everything else.
+"""
+import contextlib
+import fnmatch
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import modrod_trace
+
+EXTENSION = ".dct"
+FOLDER_SUFFIX = "_dct"
+MEMBERS_FILE = ".modrod_members"
+
+
+def find_archives(input_path):
+    """Lists the .dct files under input_path, or input_path itself if it is one."""
+    if os.path.isfile(input_path):
+        return [input_path]
+    archives = []
+    for dirpath, dirnames, filenames in os.walk(input_path):
+        dirnames.sort()
+        archives.extend(os.path.join(dirpath, filename) for filename in sorted(filenames)
+                        if filename.lower().endswith(EXTENSION))
+    return archives
+
+
+def find_unpacked(input_path):
+    """Lists the unpacked archive folders (named *_dct) under input_path, or input_path itself."""
+    if os.path.basename(os.path.normpath(input_path)).lower().endswith(FOLDER_SUFFIX):
+        return [input_path]
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(input_path):
+        dirnames.sort()
+        for dirname in list(dirnames):
+            if dirname.lower().endswith(FOLDER_SUFFIX):
+                folders.append(os.path.join(dirpath, dirname))
+                # An archive's contents are not searched for more archives.
+                dirnames.remove(dirname)
+    return folders
+
+
+def target_path(path, input_path, output_folder):
+    """Mirrors path, found under input_path, into output_folder."""
+    if os.path.normpath(path) == os.path.normpath(input_path):
+        return os.path.join(output_folder, os.path.basename(os.path.normpath(path)))
+    return os.path.join(output_folder, os.path.relpath(path, input_path))
+
+
+def unpacked_path(archive):
+    """levels/track.dct -> levels/track_dct"""
+    return os.path.normpath(archive)[:-len(EXTENSION)] + FOLDER_SUFFIX
+
+
+def archive_path(folder):
+    """levels/track_dct -> levels/track.dct"""
+    return os.path.normpath(folder)[:-len(FOLDER_SUFFIX)] + EXTENSION
+
+
+def matches(relative, patterns):
+    """True if relative (a "/" path inside an archive) matches any glob, by full path or file name."""
+    if not patterns:
+        return True
+    relative = relative.lower()
+    name = relative.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(relative, pattern.lower()) or fnmatch.fnmatch(name, pattern.lower())
+               for pattern in patterns)
+
+
+def run_offsetting(offsetting_path, args, job=None):
+    """Runs offsetting and returns (returncode, output, resource usage).
+
+    The process is registered with job, if given, so cancelling the job
+    terminates it.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([offsetting_path] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, errors="replace")
+    with job.track_process(process) if job is not None else contextlib.nullcontext():
+        output = process.stdout.read()
+        process.stdout.close()
+        returncode, usage = modrod_trace.wait_process(process)
+    usage["seconds"] = time.perf_counter() - start
+    return returncode, output, usage
+
+
+def list_tree(folder):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        files.extend(os.path.join(dirpath, filename) for filename in filenames)
+    return sorted(files)
+
+
+def load_members(folder):
+    """Returns the set of "/" paths unpacking put into folder, or None if it was not unpacked here."""
+    try:
+        with open(os.path.join(folder, MEMBERS_FILE), "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def save_members(folder, members):
+    path = os.path.join(folder, MEMBERS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(sorted(members), f, indent=0)
+    os.replace(path + ".tmp", path)
+
+
+def unpack_archive(offsetting_path, archive, target_dir, patterns=None, job=None):
+    """Unpacks archive into target_dir, keeping only the members matching patterns.
+
+    Returns a result dict with the extracted files; error is None on success.
+    """
+    if os.path.exists(target_dir) and not os.path.isdir(target_dir):
+        raise OSError(f"Cannot unpack {archive}: {target_dir} exists and is not a folder")
+    temp_dir = f"{os.path.normpath(target_dir)}.{uuid.uuid4().hex[:8]}.modrod.tmp"
+    os.makedirs(temp_dir)
+    try:
+        returncode, output, usage = run_offsetting(offsetting_path, ["dct", "unpack", archive, temp_dir], job)
+        files = []
+        error = None
+        if returncode != 0:
+            error = output.strip() or f"offsetting exited with {returncode}"
+        else:
+            members = load_members(target_dir) or set()
+            for path in list_tree(temp_dir):
+                relative = os.path.relpath(path, temp_dir).replace(os.sep, "/")
+                if not matches(relative, patterns):
+                    continue
+                destination = os.path.join(target_dir, *relative.split("/"))
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(path, destination)
+                files.append(destination)
+                members.add(relative)
+            os.makedirs(target_dir, exist_ok=True)
+            save_members(target_dir, members)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {"input": archive, "output": target_dir, "files": files, "error": error, "returncode": returncode,
+            "usage": usage}
+
+
+def is_derived(relative, members):
+    """True for a file named like a decode output that the archive did not contain.
+
+    That is x.json beside an x.oct member, as offsetting decode writes it,
+    or x.dec.lua beside an x.lua member, as unluac does.
+    """
+    if members is None or relative in members:
+        return False
+    for output_ext, input_ext in ((".dec.lua", ".lua"), (".json", ".oct")):
+        if relative.endswith(output_ext):
+            return relative[:-len(output_ext)] + input_ext in members
+    return False
+
+
+def stage_folder(folder, staging_dir):
+    """Links every member and added file under folder into staging_dir. Returns False if there was nothing to skip."""
+    members = load_members(folder)
+    if members is None:
+        return False
+    for path in list_tree(folder):
+        relative = os.path.relpath(path, folder).replace(os.sep, "/")
+        if relative == MEMBERS_FILE or is_derived(relative, members):
+            continue
+        destination = os.path.join(staging_dir, os.path.relpath(path, folder))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.link(path, destination)
+        except OSError:
+            shutil.copy2(path, destination)
+    return True
+
+
+def pack_archive(offsetting_path, folder, archive, job=None):
+    os.makedirs(os.path.dirname(os.path.abspath(archive)), exist_ok=True)
+    staging_dir = f"{os.path.normpath(archive)}.{uuid.uuid4().hex[:8]}.modrod.tmp"
+    try:
+        source = staging_dir if stage_folder(folder, staging_dir) else folder
+        returncode, output, usage = run_offsetting(offsetting_path, ["dct", "pack", source, archive], job)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    error = None
+    if returncode != 0:
+        error = output.strip() or f"offsetting exited with {returncode}"
+    return {"input": folder, "output": archive, "files": [archive] if error is None else [], "error": error,
+            "returncode": returncode, "usage": usage}
+
+
+def run_batch(work, items, threads=None, on_result=None, cancel_event=None):
+    """Runs work(source, target) for every item concurrently and returns the results in item order.
+
+    An exception from one item is recorded in its result and does not stop
+    the others. Setting cancel_event skips items that have not started.
+    """
+    results = {}
+
+    def run(item):
+        source = item[0]
+        if cancel_event is not None and cancel_event.is_set():
+            result = {"input": source, "output": item[1], "files": [], "error": "cancelled", "returncode": None,
+                      "usage": {}}
+        else:
+            try:
+                result = work(*item)
+            except OSError as e:
+                result = {"input": source, "output": item[1], "files": [], "error": str(e), "returncode": None,
+                          "usage": {}}
+        results[source] = result
+        if on_result is not None:
+            on_result(result, len(results), len(items))
+        return result
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+        return list(pool.map(run, items))
+
+
+def unpack_all(offsetting_path, input_path, output_folder, patterns=None, threads=None, on_result=None,
+               cancel_event=None, job=None):
+    """Unpacks every archive under input_path into output_folder (see the module docstring).
+
+    job, if given, gets every offsetting process registered so its cancel() stops them.
+    """
+    items = [(archive, unpacked_path(target_path(archive, input_path, output_folder)))
+             for archive in find_archives(input_path)]
+    return run_batch(lambda archive, target: unpack_archive(offsetting_path, archive, target, patterns, job), items,
+                     threads, on_result, cancel_event)
+
+
+def pack_all(offsetting_path, input_path, output_folder, threads=None, on_result=None, cancel_event=None,
+             job=None):
+    """Packs every *_dct folder under input_path into an archive at the same place under output_folder."""
+    items = [(folder, archive_path(target_path(folder, input_path, output_folder)))
+             for folder in find_unpacked(input_path)]
+    return run_batch(lambda folder, archive: pack_archive(offsetting_path, folder, archive, job), items,
+                     threads, on_result, cancel_event)
+
+
+def format_results(results, verb):
+    lines = []
+    for result in results:
+        if result["error"] is not None:
+            lines.append(f"FAILED   {result['input']}: {result['error'].splitlines()[-1]}")
+        else:
+            lines.append(f"OK       {result['input']} -> {result['output']} ({len(result['files'])} file(s))")
+    failed = sum(1 for result in results if result["error"] is not None)
+    lines.append(f"{verb} {len(results) - failed}/{len(results)} archive(s), {failed} failed")
+    return "\n".join(lines)
@@ -0,0 +1,180 @@
+"""Streaming, resumable, checksum-cached downloads for the external tools.
+
+Downloads stream to a partial file in the cache directory, resume with an
+HTTP Range request after an interruption and are stored once under their
+SHA-256. Installing copies out of that store through a temp file and an
+atomic rename, so reinstalling, or setting up a second workspace, only
+costs a conditional request (or nothing at all when offline).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+CHUNK_SIZE = 256 * 1024
+RETRIES = 3
+TIMEOUT = 30
+
+
+def default_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "octane_modrod", "downloads")
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.lock = threading.Lock()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_index(self, url, **fields):
+        with self.lock:
+            index = self._load_index()
+            entry = index.setdefault(url, {})
+            entry.update(fields)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest)
+
+    def partial_path(self, url):
+        return os.path.join(self.cache_dir, "partial", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def cached_object(self, url):
+        """Returns (entry, path) for a verified cached copy of url, or (entry, None)."""
+        entry = self._load_index().get(url, {})
+        digest = entry.get("sha256")
+        if digest and os.path.exists(self.object_path(digest)) and hash_file(self.object_path(digest)) == digest:
+            return entry, self.object_path(digest)
+        return entry, None
+
+    def fetch(self, url, session=None, progress=None):
+        """Makes sure url is in the store and returns its SHA-256.
+
+        A cached copy is revalidated with If-None-Match/If-Modified-Since
+        and used as is on 304, or when the server cannot be reached or
+        answers with an error. A 200 is the new version and is stored
+        straight from that response.
+        """
+        import requests
+        session = session or requests.Session()
+        entry, cached_path = self.cached_object(url)
+        headers = {}
+        if cached_path:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            headers["Accept-Encoding"] = "identity"
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code == 304:
+                        print(f"Using cached download of {url}")
+                        return entry["sha256"]
+                    response.raise_for_status()
+                    print(f"{url} changed, downloading the new version")
+                    return self._receive(url, response, 0, entry, progress)
+            except (requests.RequestException, DownloadError) as e:
+                print(f"Could not revalidate {url} ({e}), using cached copy")
+                return entry["sha256"]
+        last_error = None
+        for attempt in range(RETRIES):
+            try:
+                return self._download(url, session, entry, progress)
+            except (requests.RequestException, DownloadError) as e:
+                last_error = e
+                print(f"Download of {url} interrupted ({e}), attempt {attempt + 1}/{RETRIES}")
+        raise DownloadError(f"Failed to download {url}: {last_error}")
+
+    def _download(self, url, session, entry, progress):
+        partial = self.partial_path(url)
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {"Accept-Encoding": "identity"}
+        validator = entry.get("partial_validator")
+        if offset and validator:
+            # If-Range makes the server send the whole file again if it changed.
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 416:
+                os.remove(partial)
+                raise DownloadError(f"Server rejected resuming {url} at byte {offset}")
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            return self._receive(url, response, offset, entry, progress)
+
+    def _receive(self, url, response, offset, entry, progress):
+        """Streams a successful response into the partial file from offset and stores the result."""
+        partial = self.partial_path(url)
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        validator = etag or last_modified
+        entry["partial_validator"] = validator
+        self._update_index(url, partial_validator=validator)
+        length = response.headers.get("Content-Length")
+        total = offset + int(length) if length else None
+        if offset:
+            print(f"Resuming download of {url} at byte {offset}")
+        received = offset
+        with open(partial, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+                if progress is not None:
+                    progress(received, total)
+        if total is not None and received != total:
+            raise DownloadError(f"Download of {url} ended at {received} of {total} bytes")
+        digest = hash_file(partial)
+        object_path = self.object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(partial, object_path)
+        self._update_index(url, sha256=digest, etag=etag, last_modified=last_modified, size=received,
+                           partial_validator=None)
+        return digest
+
+    def install(self, url, dest_path, sha256=None, session=None, progress=None):
+        """Downloads url (or reuses the cache) and atomically places it at dest_path.
+
+        With sha256 the download must match it or DownloadError is raised.
+        """
+        digest = self.fetch(url, session, progress)
+        if sha256 and digest != sha256.lower():
+            raise DownloadError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+        dest_dir = os.path.dirname(os.path.abspath(dest_path))
+        os.makedirs(dest_dir, exist_ok=True)
+        temp_path = os.path.join(dest_dir, f".{os.path.basename(dest_path)}.tmp")
+        shutil.copyfile(self.object_path(digest), temp_path)
+        shutil.copymode(self.object_path(digest), temp_path)
+        os.replace(temp_path, dest_path)
+        print(f"Installed {url} to {dest_path} (sha256 {digest})")
+        return digest
+
+
+def download(url, dest_path, sha256=None, cache_dir=None, progress=None):
+    return DownloadCache(cache_dir).install(url, dest_path, sha256, progress=progress)
@@ -0,0 +1,219 @@
+"""Persistent SQLite index of the assets in a game install or extracted archive.
+
+A scan walks the tree once and records every OCT, DCT, Lua and texture
+file, and the XML and JSON scene sources that encodes read, with its
+size, mtime, SHA-256 and a little header metadata. Rescans only hash
+files whose size or mtime changed, and batch jobs pick their inputs with
+query() instead of walking the tree again:
+
+    index.query(root, type="oct", under="levels/", min_size=1024 * 1024)
+
+or, from the command line and the UI, the same filters as text:
+
+    type=oct under=levels/ min_size=1MB name=*.oct
+"""
+import fnmatch
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import modrod_cache
+
+DEFAULT_DB_PATH = os.path.join(modrod_cache.DEFAULT_CACHE_DIR, "assets.sqlite")
+ASSET_TYPES = {
+    ".oct": "oct",
+    ".dct": "dct",
+    ".lua": "lua",
+    ".dds": "texture",
+    ".tga": "texture",
+    ".png": "texture",
+    ".jpg": "texture",
+    ".bmp": "texture",
+    ".xml": "xml",
+    ".json": "json",
+}
+# Bumped when ASSET_TYPES grows, so roots scanned before are rescanned.
+INDEX_VERSION = 1
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+QUERY_KEYS = ("type", "under", "min_size", "max_size", "name")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    header TEXT NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS assets_by_type ON assets (root, type, size);
+CREATE TABLE IF NOT EXISTS roots (
+    root TEXT PRIMARY KEY,
+    scanned_at REAL NOT NULL
+);
+"""
+
+
+def asset_type(filename):
+    return ASSET_TYPES.get(os.path.splitext(filename)[1].lower())
+
+
+def read_header(path, kind):
+    """Cheap metadata from the first bytes of a file."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+    if kind == "lua":
+        # Compiled chunks start with ESC "Lua" and a version byte.
+        return f"bytecode {head[4]:#04x}" if head[:4] == b"\x1bLua" and len(head) > 4 else "source"
+    return head[:4].hex()
+
+
+def hash_asset(path, kind):
+    return modrod_cache.hash_file(path), read_header(path, kind)
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    number = text.rstrip("KMGB")
+    if text[len(number):] not in SIZE_UNITS:
+        raise ValueError(f"Bad size {text!r}; use e.g. 500KB or 1MB")
+    return int(float(number) * SIZE_UNITS[text[len(number):]])
+
+
+def parse_query(text):
+    """Turns "type=oct under=levels/ min_size=1MB" into query() keyword arguments."""
+    filters = {}
+    for term in text.split():
+        key, sep, value = term.partition("=")
+        if not sep or key not in QUERY_KEYS:
+            raise ValueError(f"Unknown filter {term!r}; use {', '.join(k + '=' for k in QUERY_KEYS)}")
+        filters[key] = parse_size(value) if key.endswith("_size") else value
+    return filters
+
+
+def walk(root):
+    """Yields (relative path, absolute path, stat) for every indexable file under root."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif asset_type(entry.name) is not None and entry.is_file():
+                        yield os.path.relpath(entry.path, root).replace(os.sep, "/"), entry.path, entry.stat()
+        except OSError as e:
+            print(f"Skipping {directory}: {e}")
+
+
+class AssetIndex:
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+
+    def connect(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.executescript(SCHEMA)
+        if db.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+            # Forgetting when roots were scanned marks them as not indexed
+            # for the newly indexed types until their next scan.
+            db.execute("DELETE FROM roots")
+            db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            db.commit()
+        return db
+
+    def is_scanned(self, root):
+        db = self.connect()
+        try:
+            return db.execute("SELECT 1 FROM roots WHERE root = ?", (os.path.abspath(root),)).fetchone() is not None
+        finally:
+            db.close()
+
+    def scan(self, root, threads=None, progress=None, cancel_event=None):
+        """Brings the index of root up to date and returns counts of what changed."""
+        start = time.perf_counter()
+        root = os.path.abspath(root)
+        db = self.connect()
+        try:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                     db.execute("SELECT path, size, mtime_ns FROM assets WHERE root = ?", (root,))}
+            seen = set()
+            stale = []
+            for relative, path, st in walk(root):
+                seen.add(relative)
+                if known.get(relative) != (st.st_size, st.st_mtime_ns):
+                    stale.append((relative, path, st))
+            removed = [path for path in known if path not in seen]
+            # Hashing dominates a first scan; hashlib releases the GIL.
+            with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+                futures = [pool.submit(hash_asset, path, asset_type(path)) for relative, path, st in stale]
+                for done, (future, (relative, path, st)) in enumerate(zip(futures, stale), 1):
+                    if cancel_event is not None and cancel_event.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        db.commit()
+                        raise InterruptedError("scan cancelled")
+                    try:
+                        sha256, header = future.result()
+                    except OSError:
+                        continue
+                    db.execute("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (root, relative, asset_type(path), st.st_size, st.st_mtime_ns, sha256, header))
+                    if progress is not None:
+                        progress(done, len(stale))
+            db.executemany("DELETE FROM assets WHERE root = ? AND path = ?", [(root, path) for path in removed])
+            db.execute("INSERT OR REPLACE INTO roots VALUES (?, ?)", (root, time.time()))
+            db.commit()
+        finally:
+            db.close()
+        added = sum(1 for relative, path, st in stale if relative not in known)
+        return {"files": len(seen), "added": added, "updated": len(stale) - added, "removed": len(removed),
+                "unchanged": len(seen) - len(stale), "seconds": time.perf_counter() - start}
+
+    def query(self, root, type=None, under=None, min_size=None, max_size=None, name=None):
+        """Returns the absolute paths of indexed assets under root that match every filter.
+
+        under is a path prefix relative to root and name a glob matched
+        against the file name.
+        """
+        root = os.path.abspath(root)
+        sql = "SELECT path FROM assets WHERE root = ?"
+        params = [root]
+        if type:
+            sql += " AND type = ?"
+            params.append(type.lstrip(".").lower())
+        if under:
+            prefix = under.replace(os.sep, "/").strip("/") + "/"
+            sql += " AND substr(path, 1, ?) = ?"
+            params += [len(prefix), prefix]
+        if min_size is not None:
+            sql += " AND size >= ?"
+            params.append(min_size)
+        if max_size is not None:
+            sql += " AND size <= ?"
+            params.append(max_size)
+        sql += " ORDER BY path"
+        db = self.connect()
+        try:
+            paths = [path for (path,) in db.execute(sql, params)]
+        finally:
+            db.close()
+        if name:
+            paths = [path for path in paths if fnmatch.fnmatch(path.rsplit("/", 1)[-1].lower(), name.lower())]
+        return [os.path.join(root, *path.split("/")) for path in paths]
+
+    def select(self, root, text):
+        """Runs a text query after an incremental scan of root, so it sees the files on disk."""
+        filters = parse_query(text)
+        self.scan(root)
+        return self.query(root, **filters)
+
+
+def format_scan(stats):
+    return (f"Indexed {stats['files']} assets in {stats['seconds']:.2f}s: {stats['added']} added, "
+            f"{stats['updated']} updated, {stats['removed']} removed, {stats['unchanged']} unchanged")
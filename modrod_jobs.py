@@ -0,0 +1,182 @@
+"""Background job scheduler for long-running conversions.
+
+Jobs run on a small thread pool and never touch Tk directly: everything
+they want to show is put on ``JobScheduler.events`` and the UI drains that
+queue with ``after()`` on the main thread.
+"""
+import contextlib
+import itertools
+import queue
+import subprocess
+import threading
+import time
+
+import modrod_trace
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, scheduler, job_id, name):
+        self.scheduler = scheduler
+        self.id = job_id
+        self.name = name
+        self.status = QUEUED
+        self.progress = ""
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.processes = set()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.totals = modrod_trace.new_totals()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def log(self, text):
+        self.scheduler.events.put(("output", self, text.rstrip("\n") + "\n"))
+
+    def set_progress(self, done, total):
+        self.progress = f"{done}/{total}"
+        self.scheduler.events.put(("progress", self, None))
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.terminate()
+
+    @contextlib.contextmanager
+    def track_process(self, process):
+        """Registers a running process for the with block, so cancelling the job terminates it."""
+        with self.lock:
+            self.processes.add(process)
+        # A cancel that came in before the process was registered.
+        if self.cancelled:
+            process.terminate()
+        try:
+            yield process
+        finally:
+            with self.lock:
+                self.processes.discard(process)
+
+    def run_process(self, command, stdout_path=None):
+        """Runs command, streaming its output into the job log line by line.
+
+        With stdout_path, stdout is written to that file and only stderr is
+        streamed. Returns (exit code, the process's resource usage); raises
+        JobCancelled if the job was cancelled while the process ran.
+        """
+        self.check_cancelled()
+        stdout_file = open(stdout_path, "wb") if stdout_path else None
+        try:
+            process = subprocess.Popen(command, stdout=stdout_file or subprocess.PIPE,
+                                       stderr=subprocess.PIPE if stdout_file else subprocess.STDOUT,
+                                       text=True, errors="replace", bufsize=1)
+            with self.track_process(process):
+                for line in (process.stderr if stdout_file else process.stdout):
+                    self.log(line)
+                returncode, usage = modrod_trace.wait_process(process)
+        finally:
+            if stdout_file is not None:
+                stdout_file.close()
+        self.check_cancelled()
+        return returncode, usage
+
+
+class ConsoleJob(Job):
+    """A job run inline on the command line, logging straight to stdout."""
+
+    def __init__(self, name):
+        super().__init__(None, 0, name)
+
+    def log(self, text):
+        print(text.rstrip("\n"), flush=True)
+
+    def set_progress(self, done, total):
+        self.progress = f"{done}/{total}"
+
+
+class JobScheduler:
+    def __init__(self, workers=4):
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="modrod-job")
+        self.events = queue.Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+
+    def submit(self, name, fn):
+        """Queues fn(job) and returns the Job.
+
+        fn signals failure by raising or returning False; any other return
+        value marks the job done.
+        """
+        job = Job(self, next(self.ids), name)
+        self.jobs[job.id] = job
+        self.events.put(("status", job, QUEUED))
+        self.pool.submit(self._run, job, fn)
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and job.status in (QUEUED, RUNNING):
+            job.log(f"Cancelling {job.name}")
+            job.cancel()
+
+    def poll(self):
+        """Returns all pending events without blocking.
+
+        Events are ("output", job, text), ("progress", job, None) and
+        ("status", job, new_status) tuples.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            job.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _set_status(self, job, status):
+        job.status = status
+        self.events.put(("status", job, status))
+        if status not in (QUEUED, RUNNING):
+            modrod_trace.record_job(job, status)
+
+    def _run(self, job, fn):
+        if job.cancelled:
+            self._set_status(job, CANCELLED)
+            return
+        job.started = time.perf_counter()
+        self._set_status(job, RUNNING)
+        try:
+            ok = fn(job)
+        except JobCancelled:
+            self._set_status(job, CANCELLED)
+            return
+        except Exception as e:
+            job.error = str(e)
+            job.log(f"{job.name} failed: {e}")
+            ok = False
+        if job.cancelled:
+            self._set_status(job, CANCELLED)
+        else:
+            self._set_status(job, FAILED if ok is False else DONE)
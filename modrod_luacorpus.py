@@ -0,0 +1,344 @@
+"""Decompiled Lua corpus keyed by bytecode hash, with a search index.
+
+Every script unluac decompiles is stored once in an SQLite database under
+the SHA-256 of its bytecode, along with the SHA-256 of the unluac jar that
+produced it. Decompiling a tree again, or another copy of the same script,
+writes the stored .dec.lua instead of starting unluac, so unchanged scripts
+are never decompiled twice; a different jar decompiles them afresh.
+
+Every call opens its own connection and writes in BEGIN IMMEDIATE
+transactions with a busy timeout, so threads, the UI and command line runs
+can share one database.
+
+Each stored script is indexed by three kinds of term:
+
+    token     every identifier and word in the script
+    function  every function it defines, by full name (Car.update) and last part (update)
+    string    every string literal
+
+search() takes words (all must match) with optional kind prefixes:
+
+    fn:update str:"checkpoint reached" boost* under:scripts/race
+
+A trailing * matches by prefix; str: matches anywhere inside a literal.
+Terms are matched case-insensitively.
+"""
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import modrod_cache
+
+DEFAULT_DB_PATH = os.path.join(modrod_cache.DEFAULT_CACHE_DIR, "lua.sqlite")
+KINDS = {"token": "token", "fn": "function", "function": "function", "str": "string", "string": "string"}
+MAX_LITERAL = 200
+BUSY_TIMEOUT = 30
+# Bumped when stored scripts can no longer be trusted, which drops them.
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scripts (
+    hash TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    source BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (hash);
+CREATE TABLE IF NOT EXISTS terms (
+    kind TEXT NOT NULL,
+    term TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (kind, term, hash)
+) WITHOUT ROWID;
+"""
+LUA_KEYWORDS = {"and", "break", "do", "else", "elseif", "end", "false", "for", "function", "goto", "if", "in",
+                "local", "nil", "not", "or", "repeat", "return", "then", "true", "until", "while"}
+STRING_RE = re.compile(r'"((?:[^"\\\n]|\\.)*)"|\'((?:[^\'\\\n]|\\.)*)\'|\[(=*)\[(.*?)\]\3\]', re.S)
+WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+FUNCTION_RES = (
+    re.compile(r"\bfunction\s+([A-Za-z_][\w.:]*)\s*\("),
+    re.compile(r"([A-Za-z_][\w.]*(?:\[[^\]\n]*\])?)\s*=\s*function\b"),
+)
+SEARCH_RE = re.compile(r'(\w+:)?("[^"]*"|\S+)')
+
+
+def extract_terms(source):
+    """Returns the {(kind, term)} pairs a decompiled script is indexed under."""
+    terms = set()
+    for match in STRING_RE.finditer(source):
+        literal = next(group for group in (match.group(1), match.group(2), match.group(4)) if group is not None)
+        if literal:
+            terms.add(("string", literal.lower()[:MAX_LITERAL]))
+    for pattern in FUNCTION_RES:
+        for match in pattern.finditer(source):
+            name = match.group(1).lower()
+            terms.add(("function", name))
+            terms.add(("function", re.split(r"[.:]", name)[-1]))
+    for word in WORD_RE.findall(source):
+        word = word.lower()
+        if word not in LUA_KEYWORDS:
+            terms.add(("token", word))
+    return terms
+
+
+def parse_search(text):
+    """Turns a search string into ([(kind, term, is_prefix)], under) for LuaCorpus.search()."""
+    terms = []
+    under = None
+    for prefix, value in SEARCH_RE.findall(text):
+        key = prefix[:-1].lower() if prefix else "token"
+        value = value.strip('"')
+        if key == "under":
+            under = value
+            continue
+        if key not in KINDS:
+            raise ValueError(f"Unknown search prefix {prefix!r}; use fn:, str:, under: or plain words")
+        if not value.strip("*"):
+            continue
+        terms.append((KINDS[key], value.lower().rstrip("*"), value.endswith("*")))
+    if not terms:
+        raise ValueError("Nothing to search for")
+    return terms, under
+
+
+def first_line(source, needle):
+    """Returns (line number, line) of the first line of source containing needle, ignoring case."""
+    for number, line in enumerate(source.splitlines(), 1):
+        if needle in line.lower():
+            return number, line.strip()
+    return None, ""
+
+
+def tool_version(unluac_path):
+    """Identifies the unluac build, so a new jar does not reuse what the old one decompiled."""
+    try:
+        return "unluac " + modrod_cache.hash_file(unluac_path)
+    except OSError:
+        return f"unluac {unluac_path} missing"
+
+
+class LuaCorpus:
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+
+    def connect(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Writes take the database lock up front, so two writers wait for
+        # each other instead of failing when a read turns into a write.
+        db = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level="IMMEDIATE")
+        if db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # Scripts stored before the unluac build was recorded.
+            db.executescript("DROP TABLE IF EXISTS scripts; DROP TABLE IF EXISTS terms;")
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.executescript(SCHEMA)
+        return db
+
+    def hash_files(self, db, paths, threads=None):
+        """Returns {path: bytecode sha256}, rehashing only files whose size or mtime changed."""
+        digests = {}
+        stale = []
+        for path in paths:
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            row = db.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                digests[path] = row[2]
+            else:
+                stale.append((path, st))
+        with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+            for (path, st), digest in zip(stale, pool.map(modrod_cache.hash_file, [path for path, st in stale])):
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, digest))
+                digests[path] = digest
+        db.commit()
+        return digests
+
+    def source(self, db, digest, tool):
+        row = db.execute("SELECT source FROM scripts WHERE hash = ? AND tool = ?", (digest, tool)).fetchone()
+        return row[0] if row else None
+
+    def add(self, db, digest, tool, source):
+        """Stores a script (bytes) decompiled by tool (see tool_version) and indexes it."""
+        db.execute("INSERT OR REPLACE INTO scripts VALUES (?, ?, ?)", (digest, tool, source))
+        db.execute("DELETE FROM terms WHERE hash = ?", (digest,))
+        db.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?, ?)",
+                       [(kind, term, digest) for kind, term in extract_terms(source.decode("utf-8", "replace"))])
+
+    def write_output(self, source, output_lua):
+        try:
+            with open(output_lua, "rb") as f:
+                if f.read() == source:
+                    return
+        except OSError:
+            pass
+        with open(output_lua, "wb") as f:
+            f.write(source)
+
+    def restore(self, input_lua, output_lua, unluac_path):
+        """Writes output_lua from the corpus if unluac_path already decompiled input_lua's bytecode.
+
+        Returns whether it did.
+        """
+        tool = tool_version(unluac_path)
+        db = self.connect()
+        try:
+            digest = self.hash_files(db, [input_lua])[os.path.abspath(input_lua)]
+            source = self.source(db, digest, tool)
+        finally:
+            db.close()
+        if source is None:
+            return False
+        self.write_output(source, output_lua)
+        return True
+
+    def remember(self, input_lua, output_lua, unluac_path):
+        """Adds a script decompiled outside the corpus, e.g. by a one-off unluac run."""
+        with open(output_lua, "rb") as f:
+            source = f.read()
+        tool = tool_version(unluac_path)
+        db = self.connect()
+        try:
+            self.add(db, self.hash_files(db, [input_lua])[os.path.abspath(input_lua)], tool, source)
+            db.commit()
+        finally:
+            db.close()
+
+    def decompile(self, unluac_path, lua_files, input_dir, threads=None, on_result=None, cancel_event=None):
+        """Writes a .dec.lua for every file, decompiling only bytecode the corpus has not seen.
+
+        Returns (results, stats): results are (input, output, error) tuples
+        like modrod_unluac.decompile_tree() and stats counts the files
+        restored from the corpus, decompiled and failed. Copies of a script
+        that fails to decompile are counted as failed with the same error.
+        """
+        import modrod_unluac
+        tool = tool_version(unluac_path)
+        db = self.connect()
+        try:
+            digests = self.hash_files(db, lua_files, threads)
+            by_hash = {}
+            for path, digest in digests.items():
+                by_hash.setdefault(digest, []).append(path)
+            known = {digest: self.source(db, digest, tool) for digest in by_hash}
+        finally:
+            db.close()
+        total = len(digests)
+        results = {}
+        stats = {"files": total, "from_corpus": 0, "decompiled": 0, "failed": 0}
+
+        def finished(path, error):
+            results[path] = (path, modrod_unluac.dec_output_path(path), error)
+            if on_result is not None:
+                on_result(results[path], len(results), total)
+
+        def decompiled(result, done, count):
+            # Called from unluac's threads; the corpus is filled in afterwards on this one.
+            if on_result is not None:
+                on_result(result, stats["from_corpus"] + done, total)
+
+        missing = []
+        for digest, paths in by_hash.items():
+            if known[digest] is None:
+                missing.append(paths[0])
+                continue
+            for path in paths:
+                self.write_output(known[digest], modrod_unluac.dec_output_path(path))
+                stats["from_corpus"] += 1
+                finished(path, None)
+        if missing:
+            # Identical bytecode is decompiled once; the copies are written from its result.
+            sources = {}
+            for path, output_lua, error in modrod_unluac.decompile_tree(
+                    unluac_path, input_dir, threads, on_result=decompiled, cancel_event=cancel_event,
+                    files=missing):
+                digest = digests[path]
+                results[path] = (path, output_lua, error)
+                copies = by_hash[digest][1:]
+                if error is not None:
+                    stats["failed"] += 1 + len(copies)
+                    for copy in copies:
+                        finished(copy, error)
+                    continue
+                stats["decompiled"] += 1
+                with open(output_lua, "rb") as f:
+                    sources[digest] = f.read()
+                for copy in copies:
+                    self.write_output(sources[digest], modrod_unluac.dec_output_path(copy))
+                    stats["from_corpus"] += 1
+                    finished(copy, None)
+            db = self.connect()
+            try:
+                for digest, source in sources.items():
+                    self.add(db, digest, tool, source)
+                db.commit()
+            finally:
+                db.close()
+        return [results[os.path.abspath(path)] for path in lua_files if os.path.abspath(path) in results], stats
+
+    def search(self, text, root=None, limit=50):
+        """Returns up to limit matches of a search string (see the module docstring).
+
+        Each match is a dict with the script's path, hash, and the line
+        number and text of its first hit.
+        """
+        terms, under = parse_search(text)
+        root = os.path.abspath(root) if root else None
+        clauses = []
+        params = []
+        for kind, term, is_prefix in terms:
+            if kind == "string":
+                clauses.append("SELECT hash FROM terms WHERE kind = 'string' AND instr(term, ?) > 0")
+                params.append(term)
+            elif is_prefix:
+                clauses.append("SELECT hash FROM terms WHERE kind = ? AND term >= ? AND term < ?")
+                params += [kind, term, term + "\uffff"]
+            else:
+                clauses.append("SELECT hash FROM terms WHERE kind = ? AND term = ?")
+                params += [kind, term]
+        sql = f"SELECT files.path, files.hash FROM files WHERE files.hash IN ({' INTERSECT '.join(clauses)})"
+        if root:
+            prefix = os.path.join(root, under or "").rstrip(os.sep) + os.sep
+            sql += " AND substr(files.path, 1, ?) = ?"
+            params += [len(prefix), prefix]
+        elif under:
+            sql += " AND instr(files.path, ?) > 0"
+            params.append(os.path.normpath(under))
+        sql += " ORDER BY files.path LIMIT ?"
+        params.append(limit)
+        db = self.connect()
+        try:
+            rows = db.execute(sql, params).fetchall()
+            sources = {}
+            matches = []
+            for path, digest in rows:
+                if not os.path.exists(path):
+                    continue
+                if digest not in sources:
+                    row = db.execute("SELECT source FROM scripts WHERE hash = ?", (digest,)).fetchone()
+                    sources[digest] = row[0].decode("utf-8", "replace")
+                line, snippet = first_line(sources[digest], terms[0][1])
+                matches.append({"path": path, "hash": digest, "line": line, "text": snippet})
+        finally:
+            db.close()
+        return matches
+
+    def counts(self):
+        db = self.connect()
+        try:
+            return {"scripts": db.execute("SELECT COUNT(*) FROM scripts").fetchone()[0],
+                    "files": db.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                    "terms": db.execute("SELECT COUNT(*) FROM terms").fetchone()[0]}
+        finally:
+            db.close()
+
+
+def format_matches(matches, query):
+    lines = [f"{match['path']}:{match['line'] or '?'}: {match['text'][:160]}" for match in matches]
+    lines.append(f"{len(matches)} match(es) for {query!r}")
+    return "\n".join(lines)
@@ -0,0 +1,481 @@
+"""Modding operations shared by the Tk UI and the command line.
+
+Every operation takes a job (a modrod_jobs.Job in the UI, a ConsoleJob on
+the command line) for logging, progress and cancellation, and returns True
+on success. Each tool run is recorded in the modrod_trace trace. Heavier
+modules are imported inside the operations that need them so the command
+line only pays for what it runs.
+"""
+import os
+import threading
+import time
+
+import modrod_trace
+
+CONFIG_FILE = "config.txt"
+_config_lock = threading.Lock()
+
+
+def read_config(path=CONFIG_FILE):
+    """Returns the key=value pairs saved in config.txt."""
+    config = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    config[key] = value
+    return config
+
+
+def write_config(updates, path=CONFIG_FILE):
+    """Merges updates into config.txt, keeping the keys it does not mention."""
+    with _config_lock:
+        config = read_config(path)
+        config.update(updates)
+        with open(path + ".tmp", "w") as f:
+            for key, value in config.items():
+                f.write(f"{key}={value}\n")
+        os.replace(path + ".tmp", path)
+
+
+def tool_name(command):
+    return os.path.splitext(os.path.basename(command[0]))[0]
+
+
+def run_process(job, command, stdout_path=None, stage=None, inputs=(), outputs=()):
+    """Runs command for job and traces it as stage, reading inputs and writing outputs."""
+    job.log(f"Running command: {' '.join(command)}")
+    start = time.perf_counter()
+    try:
+        returncode, usage = job.run_process(command, stdout_path)
+    except Exception:
+        modrod_trace.record(job, stage or tool_name(command), tool_name(command), inputs,
+                            seconds=time.perf_counter() - start,
+                            status="cancelled" if job.cancelled else "error")
+        raise
+    modrod_trace.record(job, stage or tool_name(command), tool_name(command), inputs,
+                        list(outputs) + ([stdout_path] if stdout_path else []),
+                        seconds=time.perf_counter() - start, usage=usage, status=returncode)
+    if returncode != 0:
+        job.log(f"Command failed with exit code {returncode}")
+    return returncode == 0
+
+
+def run_c2ditools(job, args):
+    import modrod_c2di
+    job.check_cancelled()
+    job.log(f"Running c2ditools: {' '.join(args)}")
+    returncode, output, usage = modrod_c2di.get_engine().run_measured(args)
+    modrod_trace.record(job, args[0], "c2ditools", args[1:2], args[2:3], usage=usage, status=returncode)
+    if output:
+        job.log(output)
+    if returncode != 0:
+        job.log(f"c2ditools failed with exit code {returncode}")
+    return returncode == 0
+
+
+def record_scene_result(job, mode, result):
+    """Traces one modrod_batch result."""
+    if result["cached"] is not None:
+        status = "cached"
+    elif result["error"] is not None:
+        status = result.get("returncode") or ("cancelled" if result["error"] == "cancelled" else "error")
+    else:
+        status = 0
+    modrod_trace.record(job, mode, "cache" if result["cached"] else "c2ditools", [result["input"]],
+                        [result["output"]], seconds=result["seconds"], usage=result.get("usage"), status=status)
+
+
+def cached_encode(job, cache, operation, input_path, output_path, tool_version, textures_dir, encode):
+    """Runs encode() unless the build cache already holds output_path for these inputs."""
+    if cache is None:
+        return encode()
+    try:
+        key = cache.key(operation, input_path, tool_version, cache.directory_hash(textures_dir))
+        cached = cache.restore(key, output_path)
+    except OSError as e:
+        job.log(f"Build cache unavailable for {input_path}: {e}")
+        return encode()
+    if cached is not None:
+        modrod_trace.record(job, operation, "cache", [input_path], [output_path], seconds=0.0, status="cached")
+        job.log(f"{output_path} is up to date ({cached} from build cache)")
+        cache.save()
+        return True
+    if not encode():
+        return False
+    cache.store(key, output_path)
+    cache.save()
+    return True
+
+
+def store_textures(job, texture_store, textures_dir, restore=None):
+    import modrod_textures
+    if not os.path.isdir(textures_dir):
+        return
+    try:
+        stats = texture_store.ingest(textures_dir, restore=restore)
+    except OSError as e:
+        job.log(f"Texture store unavailable for {textures_dir}: {e}")
+        return
+    job.log(modrod_textures.format_ingest(stats, textures_dir))
+
+
+def detach_textures(job, textures_dir, texture_store=None):
+    """Removes the files in textures_dir still linked into the texture store before a decode writes there.
+
+    scene_dec overwrites textures in place, which would write through a
+    link into the shared blob (or fail on its read-only mode), so this runs
+    whether or not the decode deduplicates. Returns what reattach_textures()
+    needs to put back.
+    """
+    import modrod_textures
+    try:
+        return (texture_store or modrod_textures.TextureStore()).detach(textures_dir)
+    except OSError as e:
+        job.log(f"Could not detach {textures_dir} from the texture store: {e}")
+        return {}
+
+
+def reattach_textures(job, texture_store, textures_dir, removed):
+    """Dedupes textures_dir with texture_store, or restores the detached files as plain copies without one."""
+    import modrod_textures
+    if texture_store is not None:
+        store_textures(job, texture_store, textures_dir, removed)
+        return
+    if not removed:
+        return
+    try:
+        modrod_textures.TextureStore().restore(textures_dir, removed, ["copy"])
+    except OSError as e:
+        job.log(f"Could not restore textures in {textures_dir}: {e}")
+
+
+def scene_decode(job, input_path, output_path, textures_dir, texture_store=None):
+    """Decodes one scene; with a TextureStore its textures are deduplicated afterwards."""
+    removed = detach_textures(job, textures_dir, texture_store)
+    ok = run_c2ditools(job, ["scene_dec", input_path, output_path, "-t", textures_dir])
+    reattach_textures(job, texture_store, textures_dir, removed)
+    return ok
+
+
+def scene_encode(job, input_path, output_path, textures_dir, cache=None):
+    args = ["scene_enc", input_path, output_path, "-t", textures_dir]
+    tool_version = None
+    if cache is not None:
+        import modrod_cache
+        import modrod_textures
+        tool_version = modrod_cache.c2ditools_version()
+        cache.remember_hashes(modrod_textures.TextureStore().resolve(textures_dir))
+    return cached_encode(job, cache, "scene_enc", input_path, output_path, tool_version, textures_dir,
+                         lambda: run_c2ditools(job, args))
+
+
+def scene_folder(job, mode, input_folder, output_folder, textures_dir=None, cache=None, query=None,
+                 texture_store=None):
+    """Converts every scene under input_folder, or only the indexed ones matching query."""
+    import modrod_batch
+    textures_dir = textures_dir or modrod_batch.default_textures_dir(mode, input_folder, output_folder)
+    files = None
+    if query:
+        files = index_select(job, input_folder, query)
+        if files is None:
+            return False
+    removed = detach_textures(job, textures_dir, texture_store) if mode == "scene_dec" else None
+
+    def on_result(result, done, total):
+        record_scene_result(job, mode, result)
+        job.set_progress(done, total)
+
+    results = modrod_batch.run_scene_batch(mode, input_folder, output_folder, textures_dir, on_result=on_result,
+                                           cache=cache, cancel_event=job.cancel_event, files=files)
+    if removed is not None:
+        reattach_textures(job, texture_store, textures_dir, removed)
+    table = modrod_batch.format_results(results)
+    job.log(table)
+    return all(result["error"] is None for result in results)
+
+
+def index_scan(job, root):
+    import modrod_index
+    job.log(f"Indexing {root}")
+    try:
+        stats, usage = modrod_trace.measure(modrod_index.AssetIndex().scan, root, None, job.set_progress,
+                                            job.cancel_event)
+    except InterruptedError:
+        job.check_cancelled()
+        raise
+    modrod_trace.record(job, "index", "modrod_index", usage=usage, input=root)
+    job.log(modrod_index.format_scan(stats))
+    return True
+
+
+def index_select(job, root, query):
+    """Returns the indexed assets under root matching query, or None if the query is invalid."""
+    import modrod_index
+    start = time.perf_counter()
+    try:
+        files = modrod_index.AssetIndex().select(root, query)
+    except ValueError as e:
+        job.log(str(e))
+        return None
+    job.log(f"{len(files)} asset(s) under {root} match {query!r} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return files
+
+
+def offsetting_decode(job, offsetting_path, input_path, output_path=None):
+    output_path = output_path or input_path.replace(".oct", ".json")
+    return run_process(job, [offsetting_path, "oct", "decode", "-t", input_path, output_path], stage="oct decode",
+                       inputs=[input_path], outputs=[output_path])
+
+
+def offsetting_encode(job, offsetting_path, input_path, output_path=None, cache=None):
+    import modrod_cache
+    output_path = output_path or input_path.replace(".json", ".oct")
+    command = [offsetting_path, "oct", "encode", "-t", input_path, output_path]
+    return cached_encode(job, cache, "oct encode", input_path, output_path,
+                         modrod_cache.executable_version(offsetting_path), None,
+                         lambda: run_process(job, command, stage="oct encode", inputs=[input_path], outputs=[output_path]))
+
+
+def dct_progress(job, stage):
+    """An on_result callback for modrod_dct batches that traces each archive and updates progress."""
+    def on_result(result, done, total):
+        status = result["returncode"]
+        if status is None:
+            status = "cancelled" if result["error"] == "cancelled" else "error"
+        modrod_trace.record(job, stage, "offsetting", [result["input"]], result["files"], usage=result["usage"],
+                            status=status)
+        job.set_progress(done, total)
+    return on_result
+
+
+def dct_unpack(job, offsetting_path, input_path, output_folder, patterns=None, decode=False, unluac_path=None):
+    """Unpacks one .dct or every .dct under input_path, keeping only members matching patterns.
+
+    The extracted files can go straight on to offsetting_decode (decode)
+    and decrypt_lua_folder (unluac_path).
+    """
+    import modrod_dct
+
+    job.log(f"Unpacking {input_path} into {output_folder}" + (f" (only {', '.join(patterns)})" if patterns else ""))
+    results = modrod_dct.unpack_all(offsetting_path, input_path, output_folder, patterns,
+                                    on_result=dct_progress(job, "dct unpack"), cancel_event=job.cancel_event,
+                                    job=job)
+    job.log(modrod_dct.format_results(results, "Unpacked"))
+    job.check_cancelled()
+    ok = all(result["error"] is None for result in results)
+    files = [path for result in results for path in result["files"]]
+    if decode:
+        from concurrent.futures import ThreadPoolExecutor
+        extracted = set(files)
+        octs = []
+        for path in files:
+            if path.lower().endswith(".oct"):
+                if path.replace(".oct", ".json") in extracted:
+                    # The archive has its own x.json; decoding would overwrite it.
+                    job.log(f"Not decoding {path}: the archive contains {path.replace('.oct', '.json')}")
+                    continue
+                octs.append(path)
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            ok = all(pool.map(lambda path: offsetting_decode(job, offsetting_path, path), octs)) and ok
+    if unluac_path:
+        ok = decrypt_lua_folder(job, unluac_path, output_folder, files=files) and ok
+    return ok
+
+
+def dct_pack(job, offsetting_path, input_path, output_folder):
+    """Packs one unpacked *.dct folder, or every one under input_path, back into archives."""
+    import modrod_dct
+
+    job.log(f"Packing {input_path} into {output_folder}")
+    results = modrod_dct.pack_all(offsetting_path, input_path, output_folder,
+                                  on_result=dct_progress(job, "dct pack"), cancel_event=job.cancel_event, job=job)
+    job.log(modrod_dct.format_results(results, "Packed"))
+    job.check_cancelled()
+    return all(result["error"] is None for result in results)
+
+
+def pack_zip(job, input_folder, output_zip, use_c2ditools=False, incremental=True):
+    """Packs input_folder with the native threaded packer, or with c2ditools why.
+
+    When incremental is set and output_zip exists, only the changed files are
+    recompressed into it.
+    """
+    if use_c2ditools:
+        if not run_c2ditools(job, ["why", input_folder, output_zip]):
+            return False
+        job.log(f"Packed {output_zip} successfully.")
+        return True
+    import modrod_zip
+    job.log(f"Packing {input_folder} into {output_zip}")
+    try:
+        pack = modrod_zip.repack_folder if incremental else modrod_zip.pack_folder
+        stats, usage = modrod_trace.measure(lambda: pack(input_folder, output_zip, progress=job.set_progress,
+                                                         cancel_event=job.cancel_event))
+    except InterruptedError:
+        job.check_cancelled()
+        raise
+    modrod_trace.record(job, "repack" if incremental else "pack", "modrod_zip", usage=usage, input=input_folder,
+                        bytes_in=stats["bytes_in"], bytes_out=stats["bytes_out"], mode=stats["mode"])
+    job.log(modrod_zip.format_stats(stats))
+    return True
+
+
+def build_recipe(job, recipe_path, offsetting_path=""):
+    """Builds a release archive from a modrod_pipeline recipe."""
+    import modrod_pipeline
+    import modrod_zip
+    try:
+        stats, usage = modrod_trace.measure(lambda: modrod_pipeline.build(
+            recipe_path, offsetting_path=offsetting_path, log=job.log, progress=job.set_progress,
+            cancel_event=job.cancel_event))
+    except modrod_pipeline.PipelineError as e:
+        job.log(str(e))
+        modrod_trace.record(job, "build", "modrod_pipeline", [recipe_path], status="error")
+        return False
+    except InterruptedError:
+        job.check_cancelled()
+        raise
+    modrod_trace.record(job, "build", "modrod_pipeline", [recipe_path], usage=usage, bytes_in=stats["bytes_in"],
+                        bytes_out=stats["bytes_out"])
+    job.log(modrod_zip.format_stats(stats))
+    return True
+
+
+def lua_search(job, query, root=None, limit=50):
+    """Logs the decompiled scripts matching query (see modrod_luacorpus)."""
+    import modrod_luacorpus
+    start = time.perf_counter()
+    try:
+        matches = modrod_luacorpus.LuaCorpus().search(query, root, limit)
+    except ValueError as e:
+        job.log(str(e))
+        return False
+    job.log(modrod_luacorpus.format_matches(matches, query))
+    job.log(f"Searched in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return True
+
+
+def watch_workspace(job, workspace, offsetting_path="", output_dir=None, textures_dir=None, cache=None,
+                    output_zip=None, pack_folder=None):
+    """Re-encodes every .xml (scene_enc) and .json (oct encode) saved under workspace until cancelled.
+
+    Outputs go next to their sources as .oct, or into the same tree under
+    output_dir. Only JSON with an .oct to encode to (beside it or already
+    under output_dir) is encoded, so recipes and other JSON are left alone.
+    XML scenes use textures_dir, or the textures folder beside them. With
+    output_zip, pack_folder (default output_dir, else workspace) is
+    repacked incrementally after each batch. The watch runs as a job, so it
+    holds one of the scheduler's worker slots until it is cancelled.
+    """
+    import modrod_watch
+    from concurrent.futures import ThreadPoolExecutor
+    watcher = modrod_watch.Watcher(workspace)
+    job.log(f"Watching {workspace} for saved .xml and .json files")
+
+    def encode(input_path):
+        try:
+            return encode_one(input_path)
+        except Exception as e:
+            if job.cancelled:
+                raise
+            # A bad save must not stop the watch.
+            job.log(f"Encoding {input_path} failed: {e}")
+            return False
+
+    def output_of(input_path):
+        output_path = os.path.splitext(input_path)[0] + ".oct"
+        if output_dir:
+            return os.path.join(output_dir, os.path.relpath(output_path, workspace))
+        return output_path
+
+    def is_source(input_path):
+        if input_path.lower().endswith(".xml"):
+            return True
+        return (os.path.exists(os.path.splitext(input_path)[0] + ".oct")
+                or os.path.exists(output_of(input_path)))
+
+    def encode_one(input_path):
+        output_path = output_of(input_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if input_path.lower().endswith(".xml"):
+            textures = textures_dir or os.path.join(os.path.dirname(input_path), "textures")
+            return scene_encode(job, input_path, output_path, textures, cache)
+        if not os.path.exists(offsetting_path):
+            job.log(f"Skipped {input_path}: offsetting not found at {offsetting_path!r}")
+            return False
+        return offsetting_encode(job, offsetting_path, input_path, output_path, cache)
+
+    def on_change(paths):
+        paths = [path for path in paths if is_source(path)]
+        if not paths:
+            return
+        start = time.perf_counter()
+        job.log(f"Changed: {', '.join(os.path.relpath(path, workspace) for path in paths)}")
+        with ThreadPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as pool:
+            results = list(pool.map(encode, paths))
+        if output_zip and any(results):
+            pack_zip(job, pack_folder or output_dir or workspace, output_zip)
+        job.log(f"Re-encoded {sum(results)}/{len(paths)} file(s) in {time.perf_counter() - start:.2f}s")
+
+    watcher.watch(on_change, job.cancel_event)
+    job.check_cancelled()
+    return True
+
+
+def decrypt_lua(job, unluac_path, input_lua, corpus=None):
+    """Decompiles one script, or writes it from the Lua corpus if its bytecode was decompiled before."""
+    import modrod_luacorpus
+    import modrod_unluac
+    corpus = corpus or modrod_luacorpus.LuaCorpus()
+    output_lua = modrod_unluac.dec_output_path(input_lua)
+    job.log(f"Output will be saved to {output_lua}")
+    if corpus.restore(input_lua, output_lua, unluac_path):
+        modrod_trace.record(job, "unluac", "corpus", [input_lua], [output_lua], seconds=0.0, status="cached")
+        job.log(f"{output_lua} written from the Lua corpus")
+        return True
+    # unluac streams to stdout, so a failed or cancelled run must not leave a partial script behind.
+    temp_lua = output_lua + ".tmp"
+    try:
+        ok = run_process(job, ["java", "-jar", unluac_path, input_lua], stdout_path=temp_lua, stage="unluac",
+                         inputs=[input_lua])
+        if ok:
+            os.replace(temp_lua, output_lua)
+    finally:
+        if os.path.exists(temp_lua):
+            os.remove(temp_lua)
+    if not ok:
+        return False
+    corpus.remember(input_lua, output_lua, unluac_path)
+    return True
+
+
+def decrypt_lua_folder(job, unluac_path, input_folder, query=None, files=None, corpus=None):
+    """Decompiles every script under input_folder that the Lua corpus has not seen and restores the rest."""
+    import modrod_luacorpus
+    import modrod_unluac
+    if query:
+        files = index_select(job, input_folder, query)
+        if files is None:
+            return False
+    if files is None:
+        files = modrod_unluac.find_lua_files(input_folder)
+    else:
+        files = [path for path in files if modrod_unluac.is_compiled_lua(path)]
+    corpus = corpus or modrod_luacorpus.LuaCorpus()
+    start = time.perf_counter()
+    # The unluac JVM works on many files at once, so it is traced as one run.
+    (results, stats), usage = modrod_trace.measure(lambda: corpus.decompile(
+        unluac_path, files, input_folder, on_result=lambda result, done, total: job.set_progress(done, total),
+        cancel_event=job.cancel_event))
+    job.log(f"{stats['from_corpus']} script(s) from the Lua corpus, {stats['decompiled']} decompiled")
+    failed = [(input_lua, error) for input_lua, output_lua, error in results if error]
+    modrod_trace.record(job, "unluac folder", "java", [input_lua for input_lua, output_lua, error in results],
+                        [output_lua for input_lua, output_lua, error in results if not error], usage=usage,
+                        status=len(failed), input=input_folder)
+    for input_lua, error in failed:
+        job.log(f"Failed: {input_lua}: {error}")
+    summary = f"Decrypted {len(results) - len(failed)}/{len(results)} .lua files in {time.perf_counter() - start:.1f}s"
+    job.log(summary)
+    return not failed
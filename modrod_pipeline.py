@@ -0,0 +1,219 @@
+"""Declarative decode -> patch -> encode -> pack builds.
+
+A build recipe is a JSON file, with paths relative to the recipe:
+
+    {
+        "output": "release.zip",
+        "base": "mod",
+        "textures": "textures",
+        "assets": [
+            {"source": "mod/scenes/track.oct", "patches": ["patches/track.py"]},
+            {"source": "originals/cars.oct", "target": "data/cars.oct", "tool": "offsetting",
+             "patches": ["patches/cars.py:faster"]}
+        ]
+    }
+
+Files under base are packed as they are. Each asset is decoded in its own
+temp directory (to XML with c2ditools, or to JSON with offsetting), run
+through its patch hooks, encoded again and compressed straight into the
+archive as target, which defaults to the source's path under base (or its
+file name). Assets are independent, so they are built in parallel while
+the archive is being written, no more at once than the archive writer keeps
+queued. c2ditools assets decode their textures into the shared textures
+folder, and scene_dec rewrites the textures one asset is encoding from, so
+assets that share a textures folder are built one at a time; the rest still
+run in parallel with them.
+
+A patch hook is a function ``patch(document, asset)`` (or the name after
+the colon) in a Python file. document is an ElementTree for XML and the
+parsed value for JSON; hooks edit it in place or return a replacement.
+Written back, XML keeps the comments and processing instructions inside
+its root element; a DOCTYPE and comments outside the root are dropped, and
+JSON is re-indented.
+"""
+import contextlib
+import json
+import os
+import runpy
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import modrod_zip
+
+TOOLS = ("c2ditools", "offsetting")
+# One lock per textures folder, held from decode to encode.
+texture_locks = {}
+texture_locks_lock = threading.Lock()
+
+
+class PipelineError(Exception):
+    pass
+
+
+def load_recipe(path):
+    """Reads a recipe and resolves its paths and defaults."""
+    try:
+        with open(path, "r") as f:
+            recipe = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PipelineError(f"Could not read recipe {path}: {e}") from e
+    if not isinstance(recipe, dict):
+        raise PipelineError(f"{path} is not a recipe object")
+    root = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value):
+        return os.path.normpath(os.path.join(root, value)) if value else value
+
+    if "output" not in recipe:
+        raise PipelineError(f"{path} does not name an output archive")
+    recipe["output"] = resolve(recipe["output"])
+    recipe["base"] = resolve(recipe.get("base"))
+    recipe["textures"] = resolve(recipe.get("textures"))
+    targets = set()
+    for number, asset in enumerate(recipe.setdefault("assets", []), 1):
+        if not isinstance(asset, dict) or "source" not in asset:
+            raise PipelineError(f"Asset {number} in {path} has no source")
+        asset["source"] = resolve(asset["source"])
+        asset.setdefault("tool", "c2ditools")
+        if asset["tool"] not in TOOLS:
+            raise PipelineError(f"Unknown tool {asset['tool']!r} for {asset['source']}")
+        if "target" not in asset:
+            base = recipe["base"]
+            if base and os.path.commonpath([base, asset["source"]]) == base:
+                asset["target"] = os.path.relpath(asset["source"], base).replace(os.sep, "/")
+            else:
+                asset["target"] = os.path.basename(asset["source"])
+        if asset["target"] in targets:
+            raise PipelineError(f"More than one asset builds {asset['target']}")
+        targets.add(asset["target"])
+        patches = []
+        for spec in asset.get("patches", []):
+            hook_path, function = spec, "patch"
+            head, sep, tail = spec.rpartition(":")
+            if sep and tail.isidentifier():
+                hook_path, function = head, tail
+            patches.append((resolve(hook_path), function))
+        asset["patches"] = patches
+    return recipe
+
+
+def load_hooks(recipe):
+    """Runs every patch file once and returns {(path, function): callable}."""
+    modules = {}
+    hooks = {}
+    for asset in recipe["assets"]:
+        for hook_path, function in asset["patches"]:
+            if hook_path not in modules:
+                try:
+                    modules[hook_path] = runpy.run_path(hook_path)
+                except Exception as e:
+                    raise PipelineError(f"Could not load patch {hook_path}: {e!r}") from e
+            if not callable(modules[hook_path].get(function)):
+                raise PipelineError(f"{hook_path} has no function {function}()")
+            hooks[(hook_path, function)] = modules[hook_path][function]
+    return hooks
+
+
+def apply_patches(path, hooks, asset):
+    """Loads the decoded document at path, runs hooks over it and writes it back."""
+    is_json = path.endswith(".json")
+    if is_json:
+        with open(path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+    else:
+        parser = ElementTree.XMLParser(target=ElementTree.TreeBuilder(insert_comments=True, insert_pis=True))
+        document = ElementTree.parse(path, parser)
+    for hook in hooks:
+        result = hook(document, asset)
+        if result is not None:
+            document = result
+    if is_json:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+    else:
+        if isinstance(document, ElementTree.Element):
+            document = ElementTree.ElementTree(document)
+        document.write(path, encoding="utf-8", xml_declaration=True)
+
+
+def run_tool(asset, args, offsetting_path):
+    if asset["tool"] == "c2ditools":
+        import modrod_c2di
+        returncode, output = modrod_c2di.get_engine().run(args)
+    else:
+        result = subprocess.run([offsetting_path] + args, capture_output=True, text=True)
+        returncode, output = result.returncode, result.stdout + result.stderr
+    if returncode != 0:
+        raise PipelineError(f"{asset['tool']} {args[0]} failed for {asset['source']} "
+                            f"(exit code {returncode}):\n{output}")
+
+
+def textures_lock(textures_dir):
+    key = os.path.normcase(os.path.realpath(textures_dir))
+    with texture_locks_lock:
+        return texture_locks.setdefault(key, threading.Lock())
+
+
+def build_asset(asset, textures_dir, hooks, offsetting_path="", cancel_event=None):
+    """Decodes, patches and re-encodes one asset; returns its CompressedData."""
+    with tempfile.TemporaryDirectory(prefix="modrod_") as temp_dir:
+        stem = os.path.splitext(os.path.basename(asset["source"]))[0]
+        encoded = os.path.join(temp_dir, os.path.basename(asset["target"]))
+        lock = None
+        if asset["tool"] == "c2ditools":
+            decoded = os.path.join(temp_dir, stem + ".xml")
+            # Without a shared folder the textures stay in temp space.
+            textures = textures_dir or os.path.join(temp_dir, "textures")
+            if textures_dir:
+                lock = textures_lock(textures_dir)
+            decode = ["scene_dec", asset["source"], decoded, "-t", textures]
+            encode = ["scene_enc", decoded, encoded, "-t", textures]
+        else:
+            decoded = os.path.join(temp_dir, stem + ".json")
+            decode = ["oct", "decode", "-t", asset["source"], decoded]
+            encode = ["oct", "encode", "-t", decoded, encoded]
+        with lock or contextlib.nullcontext():
+            for stage in (decode, "patch", encode):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("build cancelled")
+                if stage == "patch":
+                    if asset["patches"]:
+                        try:
+                            apply_patches(decoded, [hooks[spec] for spec in asset["patches"]], asset)
+                        except Exception as e:
+                            raise PipelineError(f"Patching {asset['source']} failed: {e!r}") from e
+                else:
+                    run_tool(asset, stage, offsetting_path)
+        # The compressed data is spooled, so temp_dir can go right away.
+        return modrod_zip.compress_file(asset["target"], encoded)
+
+
+def build(recipe_path, threads=None, offsetting_path="", log=print, progress=None, cancel_event=None):
+    """Builds the archive a recipe describes and returns modrod_zip throughput statistics."""
+    recipe = load_recipe(recipe_path)
+    if any(asset["tool"] == "offsetting" for asset in recipe["assets"]) and not os.path.exists(offsetting_path):
+        raise PipelineError(f"The recipe needs offsetting, which was not found at {offsetting_path!r}")
+    hooks = load_hooks(recipe)
+    base_files = dict(modrod_zip.list_files(recipe["base"])) if recipe["base"] else {}
+    threads = threads or os.cpu_count() or 1
+
+    def run_asset(asset):
+        start = time.perf_counter()
+        data = build_asset(asset, recipe["textures"], hooks, offsetting_path, cancel_event)
+        log(f"Built {asset['target']} in {time.perf_counter() - start:.1f}s")
+        return data
+
+    log(f"Building {recipe['output']}: {len(recipe['assets'])} assets, {len(base_files)} base files")
+    assets = {asset["target"]: asset for asset in recipe["assets"]}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # Assets are submitted only when the archive writer queues them, so
+        # a large recipe never has more built entries waiting than it holds.
+        tasks = [(lambda asset=assets[arcname]: pool.submit(run_asset, asset)) if arcname in assets
+                 else (arcname, base_files[arcname])
+                 for arcname in sorted(set(base_files) | set(assets))]
+        return modrod_zip.pack_entries(recipe["output"], tasks, threads, progress=progress,
+                                       cancel_event=cancel_event)
@@ -0,0 +1,228 @@
+"""Content-addressed store for decoded textures.
+
+scene_dec writes every texture a scene uses into its -t directory, so
+decoding scenes into separate folders leaves many copies of the same
+shared textures. After a decode, ingest() hashes the directory, keeps one
+blob per texture under .modrod_cache/textures and turns each file into a
+link to its blob: a reflink where the filesystem supports copy-on-write,
+otherwise a hardlink, a symlink or, as a last resort, a copy.
+
+A blob is a reflink or copy of the first file seen with its content,
+which stays an ordinary file of the user's; without reflinks that first
+copy is stored twice. Blobs are read-only. A duplicate hardlinked to its
+blob shares that inode, so it is read-only too; editors that save by
+writing a new file are unaffected.
+Every decode into a directory the store has seen, deduplicating or not,
+first calls detach() to remove the linked files, so scene_dec writes new
+files instead of writing through a link into a blob. Afterwards ingest()
+links back anything the decode did not recreate, or restore() puts it
+back as a plain copy when deduplication is off.
+
+ingest() also records each directory's file hashes in a manifest, so an
+encode can pass resolve() to the build cache instead of rehashing every
+texture.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import modrod_cache
+
+DEFAULT_STORE_DIR = os.path.join(modrod_cache.DEFAULT_CACHE_DIR, "textures")
+LINK_MODES = ("reflink", "hardlink", "symlink", "copy")
+# ioctl request number of FICLONE on Linux (btrfs, XFS, bcachefs).
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+
+
+def make_link(mode, src, dst):
+    if mode == "reflink":
+        reflink(src, dst)
+    elif mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+class TextureStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, link_modes=LINK_MODES):
+        self.store_dir = store_dir
+        self.link_modes = list(link_modes)
+        self.lock = threading.Lock()
+
+    def blob_path(self, digest, ext):
+        return os.path.join(self.store_dir, "blobs", digest[:2], digest + ext.lower())
+
+    def manifest_path(self, directory):
+        key = hashlib.sha256(os.path.abspath(directory).encode("utf-8")).hexdigest()
+        return os.path.join(self.store_dir, "manifests", key + ".json")
+
+    def load_manifest(self, directory):
+        try:
+            with open(self.manifest_path(directory), "r") as f:
+                return json.load(f).get("files", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _link(self, src, dst, modes):
+        """Links dst to src with the first mode in modes that works here and returns that mode."""
+        temp_path = f"{dst}.{uuid.uuid4().hex[:8]}.modrod.tmp"
+        for mode in modes:
+            try:
+                make_link(mode, src, temp_path)
+            except (OSError, NotImplementedError):
+                continue
+            os.replace(temp_path, dst)
+            return mode
+        raise OSError(f"Could not link {dst} to {src}")
+
+    def _add_blob(self, path, blob):
+        """Puts a reflink or copy of path into the store as blob; False if it was already there."""
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self.lock:
+            if os.path.exists(blob):
+                return False
+            # A hardlink would make path the blob and the chmod below would
+            # turn the user's own file read-only.
+            self._link(path, blob, ["reflink", "copy"])
+            os.chmod(blob, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+        return True
+
+    def ingest_file(self, path, known=None):
+        """Stores one texture and links path to its blob. Returns (digest, new blob, linked)."""
+        st = os.stat(path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = modrod_cache.hash_file(path)
+        blob = self.blob_path(digest, os.path.splitext(path)[1])
+        # The first copy of a texture stays the user's own file, so only
+        # later duplicates are linked to the blob.
+        if self._add_blob(path, blob):
+            return digest, True, False
+        if os.path.samefile(path, blob):
+            return digest, False, False
+        self._link(blob, path, self.link_modes)
+        return digest, False, True
+
+    def detach(self, directory):
+        """Removes the files in directory that are still links to their blobs.
+
+        Returns {relative path: digest} of the removed files, to pass to
+        ingest() as restore.
+        """
+        directory = os.path.abspath(directory)
+        removed = {}
+        for relative, (size, mtime_ns, digest) in self.load_manifest(directory).items():
+            path = os.path.join(directory, *relative.split("/"))
+            blob = self.blob_path(digest, os.path.splitext(path)[1])
+            try:
+                if not os.path.samefile(path, blob):
+                    continue
+                # Windows refuses to delete read-only files; the mode is
+                # shared with the blob when hardlinked, so put it back.
+                if not os.path.islink(path):
+                    os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+                os.remove(path)
+                os.chmod(blob, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+            except OSError:
+                continue
+            removed[relative] = digest
+        return removed
+
+    def restore(self, directory, removed, link_modes=None):
+        """Puts back the files detach() removed that are still missing and returns their paths.
+
+        link_modes defaults to the store's; pass ["copy"] for files that
+        should no longer share anything with their blobs.
+        """
+        directory = os.path.abspath(directory)
+        restored = []
+        for relative, digest in removed.items():
+            path = os.path.join(directory, *relative.split("/"))
+            blob = self.blob_path(digest, os.path.splitext(path)[1])
+            if not os.path.lexists(path) and os.path.exists(blob):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._link(blob, path, link_modes or self.link_modes)
+                restored.append(path)
+        return restored
+
+    def ingest(self, directory, threads=None, restore=None):
+        """Dedupes every file under directory into the store and returns counts.
+
+        Files named in restore (from detach()) that are missing again are
+        linked back from their blobs.
+        """
+        directory = os.path.abspath(directory)
+        manifest = self.load_manifest(directory)
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if not filename.endswith(".modrod.tmp"):
+                    paths.append(os.path.join(dirpath, filename))
+        paths += self.restore(directory, restore or {})
+        stats = {"files": len(paths), "new": 0, "linked": 0, "bytes_shared": 0}
+        files = {}
+        with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+            futures = {}
+            for path in paths:
+                relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                futures[relative] = pool.submit(self.ingest_file, path, manifest.get(relative))
+            for relative, future in futures.items():
+                try:
+                    digest, new_blob, linked = future.result()
+                except OSError as e:
+                    print(f"Texture store skipped {relative}: {e}")
+                    continue
+                st = os.stat(os.path.join(directory, relative))
+                files[relative] = [st.st_size, st.st_mtime_ns, digest]
+                stats["new"] += new_blob
+                if linked:
+                    stats["linked"] += 1
+                    stats["bytes_shared"] += st.st_size
+        manifest_path = self.manifest_path(directory)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"directory": directory, "files": files}, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return stats
+
+    def resolve(self, directory):
+        """Returns {absolute path: [size, mtime_ns, sha256]} for textures still matching the manifest."""
+        directory = os.path.abspath(directory)
+        resolved = {}
+        for relative, (size, mtime_ns, digest) in self.load_manifest(directory).items():
+            path = os.path.join(directory, *relative.split("/"))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                resolved[path] = [size, mtime_ns, digest]
+        return resolved
+
+
+def format_ingest(stats, directory):
+    return (f"Texture store: {stats['files']} textures in {directory}, {stats['new']} new, "
+            f"{stats['linked']} deduplicated ({stats['bytes_shared'] / (1024 * 1024):.1f} MB shared)")
@@ -0,0 +1,169 @@
+"""Background, cached probing of the external toolchain.
+
+Every tool is located cheaply (a path lookup and a stat) and only asked
+for its version, which can mean starting a JVM, when its file changed
+since the last probe. Results are kept in config.txt (via on_change) as
+
+    probe.<tool>=<stamp>|<path>|<version>
+
+where the stamp is the file's mtime, or for c2ditools the version of the
+installed package (see modrod_cache.c2ditools_version), since a reinstall
+rewrites the files inside the package folder rather than the folder
+itself. A normal start costs a handful of stats. All tools are probed at once
+on background threads while the UI draws. Nothing here waits for a probe:
+get() answers from the last finished probe, or the config until then, and
+callers on the UI thread poll done() to act on fresh results.
+"""
+import importlib.util
+import os
+import shutil
+import subprocess
+import threading
+
+TOOLS = ("c2ditools", "java", "unluac", "offsetting")
+PROBE_TIMEOUT = 15
+
+
+class ToolStatus:
+    def __init__(self, name, path="", version="", mtime=None):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.mtime = mtime
+
+    @property
+    def found(self):
+        return self.mtime is not None
+
+    def to_config(self):
+        return f"{self.mtime or ''}|{self.path}|{self.version}"
+
+    @classmethod
+    def from_config(cls, name, value):
+        mtime, path, version = (value.split("|", 2) + ["", ""])[:3]
+        return cls(name, path, version, mtime or None)
+
+
+def locate(name, configured=""):
+    """Returns the file that stands for tool name, or "" if it cannot be found."""
+    if name == "c2ditools":
+        # Picks up a c2ditools that was pip installed after startup.
+        importlib.invalidate_caches()
+        try:
+            spec = importlib.util.find_spec("c2ditools")
+        except (ImportError, ValueError):
+            return ""
+        if spec is None:
+            return ""
+        if spec.submodule_search_locations:
+            return list(spec.submodule_search_locations)[0]
+        return spec.origin or ""
+    if name == "java":
+        java = shutil.which("java")
+        return os.path.realpath(java) if java else ""
+    return configured if configured and os.path.isfile(configured) else ""
+
+
+def tool_stamp(name, path):
+    """Returns what a cached probe of the tool at path stays valid for."""
+    if name == "c2ditools":
+        import modrod_cache
+        return modrod_cache.c2ditools_version()
+    return str(os.stat(path).st_mtime_ns)
+
+
+def query_version(name, path):
+    """Asks the tool at path for its version. This is the expensive part."""
+    if name == "c2ditools":
+        import modrod_cache
+        return modrod_cache.c2ditools_version()
+    if name == "unluac":
+        return f"{os.path.getsize(path)} bytes"
+    command = [path, "-version"] if name == "java" else [path, "--version"]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    # java prints its version on stderr.
+    lines = (result.stdout or result.stderr).strip().splitlines()
+    return lines[0].strip() if lines else "unknown"
+
+
+class Toolchain:
+    """Probes TOOLS concurrently and remembers the results in the config."""
+
+    def __init__(self, config=None, on_change=None):
+        config = config or {}
+        self.on_change = on_change
+        self.configured = {"unluac": config.get("unluac_path", ""), "offsetting": config.get("offsetting_path", "")}
+        self.cached = {name: ToolStatus.from_config(name, config[f"probe.{name}"])
+                       for name in TOOLS if f"probe.{name}" in config}
+        self.results = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def configure(self, **paths):
+        """Updates configured tool paths (unluac, offsetting) and re-probes them."""
+        self.configured.update(paths)
+        self.start(list(paths))
+
+    def start(self, names=TOOLS):
+        for name in names:
+            thread = threading.Thread(target=self._probe, args=(name,), daemon=True)
+            with self.lock:
+                self.threads[name] = thread
+            thread.start()
+        return self
+
+    def _probe(self, name):
+        status = self.probe(name)
+        with self.lock:
+            previous = self.cached.get(name)
+            changed = previous is None or previous.to_config() != status.to_config()
+            self.results[name] = status
+            self.cached[name] = status
+        if changed and self.on_change is not None:
+            self.on_change(status)
+
+    def probe(self, name):
+        path = locate(name, self.configured.get(name, ""))
+        if not path:
+            return ToolStatus(name)
+        try:
+            stamp = tool_stamp(name, path)
+        except OSError:
+            return ToolStatus(name)
+        cached = self.cached.get(name)
+        if cached is not None and cached.path == path and cached.mtime == stamp and cached.version:
+            return cached
+        return ToolStatus(name, path, query_version(name, path), stamp)
+
+    def done(self, names=TOOLS):
+        """True once the latest probe of every tool in names has finished; never waits."""
+        with self.lock:
+            threads = [self.threads.get(name) for name in names]
+        return all(thread is not None and not thread.is_alive() for thread in threads)
+
+    def get(self, name):
+        """Returns the latest known ToolStatus of name without waiting for a probe in progress.
+
+        Until a probe of name finishes this is what the config remembered,
+        or a not-found status.
+        """
+        with self.lock:
+            started = name in self.threads
+            status = self.results.get(name) or self.cached.get(name)
+        if not started:
+            self.start([name])
+        return status or ToolStatus(name)
+
+    def available(self, name):
+        return self.get(name).found
+
+    def refresh(self):
+        """Re-probes every tool in the background; poll done() before reading the results."""
+        return self.start()
+
+    def to_config(self):
+        with self.lock:
+            return {f"probe.{name}": status.to_config() for name, status in self.cached.items()}
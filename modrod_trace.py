@@ -0,0 +1,263 @@
+"""Per-file and per-job instrumentation written to a rotating JSONL trace.
+
+Every tool run an operation makes (a c2ditools scene, an offsetting or
+unluac call, a pack, a build) is recorded as one JSON line in
+.modrod_cache/trace.jsonl with its wall time, CPU time, peak RSS, bytes in
+and out and exit status, and each job adds a line with its totals when it
+ends. summarize() turns the trace into the slowest files and per-stage
+totals, which is what ``octane_modrod.py stats`` and the UI show.
+
+CPU and RSS come from the OS resource usage where it exists (not on
+Windows, where those fields are null). A process run through Job.run_process
+is reaped with wait4(), so its numbers are its own. c2ditools runs in a warm
+worker and is measured inside it; operations that run in this process
+(packing, building) get the whole process's usage over the call, so jobs
+that overlap in the UI inflate each other's CPU time. Peak RSS is the
+high-water mark of the process that did the work.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 3
+TOTAL_KEYS = ("files", "failures", "bytes_in", "bytes_out", "cpu_user", "cpu_sys")
+
+_tracer = None
+
+
+def _usage_from(ru):
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    max_rss_kb = ru.ru_maxrss // 1024 if sys.platform == "darwin" else ru.ru_maxrss
+    return {"cpu_user": round(ru.ru_utime, 4), "cpu_sys": round(ru.ru_stime, 4), "max_rss_kb": max_rss_kb}
+
+
+def resource_usage():
+    """Usage of this process plus its reaped children so far, or {} without the resource module."""
+    if resource is None:
+        return {}
+    own = _usage_from(resource.getrusage(resource.RUSAGE_SELF))
+    children = _usage_from(resource.getrusage(resource.RUSAGE_CHILDREN))
+    return {"cpu_user": own["cpu_user"] + children["cpu_user"], "cpu_sys": own["cpu_sys"] + children["cpu_sys"],
+            "max_rss_kb": max(own["max_rss_kb"], children["max_rss_kb"])}
+
+
+def usage_since(before):
+    after = resource_usage()
+    if not before or not after:
+        return {}
+    return {"cpu_user": round(after["cpu_user"] - before["cpu_user"], 4),
+            "cpu_sys": round(after["cpu_sys"] - before["cpu_sys"], 4),
+            "max_rss_kb": after["max_rss_kb"]}
+
+
+def measure(fn, *args):
+    """Calls fn(*args) and returns (its result, usage dict with wall "seconds")."""
+    before = resource_usage()
+    start = time.perf_counter()
+    result = fn(*args)
+    usage = usage_since(before)
+    usage["seconds"] = time.perf_counter() - start
+    return result, usage
+
+
+def wait_process(process):
+    """Waits for a Popen and returns (returncode, usage of that process alone)."""
+    if not hasattr(os, "wait4"):
+        return process.wait(), {}
+    try:
+        pid, status, ru = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait(), {}
+    # Popen.wait() returns the stored code from now on.
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, _usage_from(ru)
+
+
+def default_trace_path():
+    # modrod_cache pulls in importlib.metadata, which every subcommand would
+    # pay for at startup if it were imported with this module.
+    import modrod_cache
+    return os.path.join(modrod_cache.DEFAULT_CACHE_DIR, "trace.jsonl")
+
+
+def path_bytes(paths):
+    """Total size of the files in paths; folders count every file under them."""
+    total = 0
+    for path in paths:
+        if not path:
+            continue
+        try:
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+            else:
+                total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+class Tracer:
+    """Appends records to a JSONL file, rotating it to path.1 ... path.N when it grows past max_bytes.
+
+    path defaults to trace.jsonl in the build cache folder.
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path or default_trace_path()
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.broken = False
+
+    def rotate(self):
+        if not self.backups:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self.lock:
+            if self.broken:
+                return
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self.rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                # Tracing must never fail a job.
+                print(f"Trace disabled, could not write {self.path}: {e}")
+                self.broken = True
+
+    def read(self):
+        """Returns every record, oldest first, skipping lines that do not parse."""
+        records = []
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        with self.lock:
+            for path in paths:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        lines = f.readlines()
+                except OSError:
+                    continue
+                for line in lines:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return records
+
+
+def set_tracer(tracer):
+    """Replaces the shared tracer returned by get_tracer() and returns the previous one."""
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def get_tracer():
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def new_totals():
+    return dict.fromkeys(TOTAL_KEYS, 0)
+
+
+def record(job, stage, tool, inputs=(), outputs=(), seconds=None, usage=None, status=0, **extra):
+    """Traces one tool run for job and adds it to the job's totals.
+
+    status is the exit code, or a word such as "cached" or "cancelled".
+    Keyword arguments are stored with the record and override computed
+    fields, e.g. bytes_in when the caller already knows it.
+    """
+    usage = usage or {}
+    entry = {
+        "time": time.time(),
+        "kind": "file",
+        "job": job.name if job is not None else None,
+        "job_id": job.id if job is not None else None,
+        "stage": stage,
+        "tool": tool,
+        "input": inputs[0] if inputs else None,
+        "bytes_in": path_bytes(inputs),
+        "bytes_out": path_bytes(outputs),
+        "seconds": round(seconds if seconds is not None else usage.get("seconds", 0.0), 4),
+        "cpu_user": usage.get("cpu_user"),
+        "cpu_sys": usage.get("cpu_sys"),
+        "max_rss_kb": usage.get("max_rss_kb"),
+        "status": status,
+    }
+    entry.update(extra)
+    if job is not None:
+        with job.lock:
+            totals = job.totals
+            totals["files"] += 1
+            totals["failures"] += status not in (0, "cached")
+            for key in ("bytes_in", "bytes_out", "cpu_user", "cpu_sys"):
+                totals[key] += entry[key] or 0
+            totals["max_rss_kb"] = max(totals.get("max_rss_kb", 0), entry["max_rss_kb"] or 0)
+    get_tracer().write(entry)
+    return entry
+
+
+def record_job(job, status):
+    """Traces the end of job with the totals of everything it recorded."""
+    entry = {"time": time.time(), "kind": "job", "job": job.name, "job_id": job.id, "status": status,
+             "seconds": round(time.perf_counter() - job.started, 4)}
+    with job.lock:
+        entry.update(job.totals)
+    get_tracer().write(entry)
+    return entry
+
+
+def summarize(records, top=10):
+    """Returns the top slowest files and {stage: totals} over a list of trace records."""
+    files = [entry for entry in records if entry.get("kind") == "file"]
+    stages = {}
+    for entry in files:
+        totals = stages.setdefault(f"{entry['stage']} ({entry['tool']})",
+                                   dict(new_totals(), seconds=0.0, max_rss_kb=0))
+        totals["files"] += 1
+        totals["failures"] += entry["status"] not in (0, "cached")
+        totals["seconds"] += entry["seconds"] or 0
+        for key in ("bytes_in", "bytes_out", "cpu_user", "cpu_sys"):
+            totals[key] += entry.get(key) or 0
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], entry.get("max_rss_kb") or 0)
+    slowest = sorted(files, key=lambda entry: entry["seconds"] or 0, reverse=True)[:top]
+    jobs = [entry for entry in records if entry.get("kind") == "job"]
+    return {"slowest": slowest, "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["seconds"])),
+            "jobs": len(jobs), "job_seconds": sum(entry["seconds"] for entry in jobs)}
+
+
+def format_summary(summary):
+    """Renders summarize() as plain text for output_text and the command line."""
+    mb = 1024 * 1024
+    lines = [f"{summary['jobs']} job(s), {summary['job_seconds']:.1f}s in total", "",
+             f"{'Stage':<28}{'Files':>7}{'Fail':>6}{'Wall s':>10}{'CPU s':>9}{'MB in':>9}{'MB out':>9}{'Peak MB':>9}"]
+    for stage, totals in summary["stages"].items():
+        lines.append(f"{stage[:27]:<28}{totals['files']:>7}{totals['failures']:>6}{totals['seconds']:>10.2f}"
+                     f"{totals['cpu_user'] + totals['cpu_sys']:>9.2f}{totals['bytes_in'] / mb:>9.1f}"
+                     f"{totals['bytes_out'] / mb:>9.1f}{totals['max_rss_kb'] / 1024:>9.0f}")
+    lines += ["", "Slowest files:"]
+    for entry in summary["slowest"]:
+        lines.append(f"{entry['seconds']:>9.2f}s  {entry['stage']:<12} {entry['status']!s:<8} {entry['input']}")
+    return "\n".join(lines)
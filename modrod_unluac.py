@@ -0,0 +1,321 @@
+"""Batch .lua decompilation through one long-lived unluac JVM."""
+import os
+import subprocess
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Launched with the JDK single-file source launcher, so nothing needs to be
+# compiled ahead of time. Requests arrive on stdin as "id<TAB>input<TAB>output"
+# and each one is answered on stdout with "id<TAB>OK" or "id<TAB>ERR<TAB>msg".
+# unluac prints the decompiled script to System.out, so System.out is swapped
+# for a stream that writes to whichever output file the current thread owns.
+WORKER_SOURCE = r"""
+import java.io.*;
+import java.lang.reflect.*;
+import java.nio.charset.StandardCharsets;
+import java.util.concurrent.*;
+
+public class UnluacWorker {
+    static final ThreadLocal<OutputStream> TARGET = new ThreadLocal<>();
+
+    public static void main(String[] args) throws Exception {
+        final PrintStream console = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        final PrintStream stderr = System.err;
+        final Method entry = Class.forName(args[0]).getMethod("main", String[].class);
+        ExecutorService pool = Executors.newFixedThreadPool(Integer.parseInt(args[1]));
+        System.setOut(new PrintStream(new OutputStream() {
+            OutputStream target() {
+                OutputStream out = TARGET.get();
+                return out != null ? out : stderr;
+            }
+            public void write(int b) throws IOException { target().write(b); }
+            public void write(byte[] b, int off, int len) throws IOException { target().write(b, off, len); }
+            public void flush() throws IOException { target().flush(); }
+        }, true));
+        console.println("READY");
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = in.readLine()) != null) {
+            final String[] job = line.split("\t", 3);
+            if (job.length != 3) {
+                continue;
+            }
+            pool.submit(() -> {
+                String status = "OK";
+                try (OutputStream out = new BufferedOutputStream(new FileOutputStream(job[2]))) {
+                    TARGET.set(out);
+                    entry.invoke(null, (Object) new String[] {job[1]});
+                } catch (Throwable t) {
+                    Throwable cause = t instanceof InvocationTargetException ? t.getCause() : t;
+                    status = "ERR\t" + String.valueOf(cause).replace('\t', ' ').replace('\n', ' ');
+                } finally {
+                    TARGET.remove();
+                }
+                synchronized (console) {
+                    console.println(job[0] + "\t" + status);
+                }
+            });
+        }
+        pool.shutdown();
+        pool.awaitTermination(Long.MAX_VALUE, TimeUnit.DAYS);
+    }
+}
+"""
+
+
+def dec_output_path(input_lua):
+    """Returns the .dec.lua path decrypt_lua writes for input_lua."""
+    base_name = os.path.splitext(os.path.basename(input_lua))[0]
+    return os.path.join(os.path.dirname(input_lua), f"{base_name}.dec.lua")
+
+
+def is_compiled_lua(filename):
+    return filename.lower().endswith(".lua") and not filename.lower().endswith(".dec.lua")
+
+
+def find_lua_files(input_dir):
+    lua_files = []
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if is_compiled_lua(filename):
+                lua_files.append(os.path.join(dirpath, filename))
+    return lua_files
+
+
+def jar_main_class(jar_path):
+    try:
+        with zipfile.ZipFile(jar_path) as jar:
+            manifest = jar.read("META-INF/MANIFEST.MF").decode("utf-8", "replace")
+        for line in manifest.splitlines():
+            if line.startswith("Main-Class:"):
+                return line.split(":", 1)[1].strip()
+    except (OSError, KeyError, zipfile.BadZipFile):
+        pass
+    return "unluac.Main"
+
+
+def decompile_one(unluac_path, input_lua, output_lua, java="java"):
+    """Decompiles a single file with a fresh JVM, the way decrypt_lua does."""
+    try:
+        with open(output_lua, "wb") as f:
+            result = subprocess.run([java, "-jar", unluac_path, input_lua], stdout=f, stderr=subprocess.PIPE)
+    except OSError as e:
+        return str(e)
+    if result.returncode != 0:
+        os.remove(output_lua)
+        return result.stderr.decode("utf-8", "replace").strip() or f"unluac exited with {result.returncode}"
+    return None
+
+
+class UnluacWorker:
+    """Keeps one unluac JVM running and feeds it files over stdin.
+
+    At most ``threads`` files are decompiled at once; submit() blocks once
+    twice that many are queued so huge trees are streamed, not buffered.
+    """
+
+    def __init__(self, unluac_path, java="java", threads=None):
+        self.unluac_path = unluac_path
+        self.java = java
+        self.threads = threads or os.cpu_count() or 1
+        self.process = None
+        self.pending = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.threads * 2)
+        self.stderr_tail = deque(maxlen=20)
+        self.source_dir = None
+        self.readers = []
+        self.closing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        if self.source_dir is None:
+            self.source_dir = tempfile.mkdtemp(prefix="modrod_unluac_")
+            with open(os.path.join(self.source_dir, "UnluacWorker.java"), "w", encoding="utf-8") as f:
+                f.write(WORKER_SOURCE)
+        source_path = os.path.join(self.source_dir, "UnluacWorker.java")
+        command = [self.java, "-cp", self.unluac_path, source_path, jar_main_class(self.unluac_path), str(self.threads)]
+        print(f"Starting unluac worker: {' '.join(command)}")
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1)
+        threading.Thread(target=self._drain_stderr, args=(process,), daemon=True).start()
+        if process.stdout.readline().strip() != "READY":
+            process.wait()
+            raise RuntimeError("unluac worker failed to start: " + " ".join(self.stderr_tail))
+        # Published only once it is ready; until then submit() runs files one JVM each.
+        with self.lock:
+            self.process = process
+        reader = threading.Thread(target=self._read_results, args=(process,), daemon=True)
+        reader.start()
+        self.readers.append(reader)
+
+    def submit(self, input_lua, output_lua):
+        future = Future()
+        if "\t" in input_lua + output_lua or "\n" in input_lua + output_lua:
+            future.set_result(decompile_one(self.unluac_path, input_lua, output_lua, self.java))
+            return future
+        self.slots.acquire()
+        with self.lock:
+            process = self.process
+            if process is not None:
+                job_id = str(self.next_id)
+                self.next_id += 1
+                self.pending[job_id] = (future, input_lua, output_lua)
+        if process is None:
+            self.slots.release()
+            future.set_result(decompile_one(self.unluac_path, input_lua, output_lua, self.java))
+            return future
+        try:
+            process.stdin.write(f"{job_id}\t{input_lua}\t{output_lua}\n")
+            process.stdin.flush()
+        except OSError:
+            # The JVM died under us; _read_results() re-runs pending jobs.
+            pass
+        return future
+
+    def close(self):
+        """Lets the JVM finish everything submitted, then shuts it down."""
+        self.closing = True
+        # A reader may be restarting the JVM or retrying orphaned files right
+        # now; joining it waits for both, and a JVM it started is closed on
+        # the next round.
+        while True:
+            with self.lock:
+                process = self.process
+                readers = list(self.readers)
+            if process is not None:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+                process.wait()
+            for reader in readers:
+                reader.join()
+            with self.lock:
+                if len(self.readers) == len(readers) and self.process in (None, process):
+                    self.process = None
+                    break
+        if self.source_dir is not None:
+            for filename in os.listdir(self.source_dir):
+                os.remove(os.path.join(self.source_dir, filename))
+            os.rmdir(self.source_dir)
+            self.source_dir = None
+
+    def _drain_stderr(self, process):
+        for line in process.stderr:
+            self.stderr_tail.append(line.strip())
+
+    def _finish(self, job_id, error):
+        with self.lock:
+            entry = self.pending.pop(job_id, None)
+        if entry is not None:
+            self._resolve(entry, error)
+
+    def _resolve(self, entry, error):
+        future, input_lua, output_lua = entry
+        if error and os.path.exists(output_lua):
+            os.remove(output_lua)
+        self.slots.release()
+        future.set_result(error)
+
+    def _read_results(self, process):
+        try:
+            for line in process.stdout:
+                parts = line.rstrip("\n").split("\t", 2)
+                if len(parts) < 2:
+                    # Stray output, e.g. a script printing from a static initialiser.
+                    print(f"Ignoring unexpected unluac worker output: {line.strip()[:200]}")
+                    continue
+                if parts[0] in self.pending:
+                    self._finish(parts[0], None if parts[1] == "OK" else parts[-1])
+        except Exception as e:
+            # Nothing else reads the JVM's answers, so it must not outlive this thread.
+            print(f"unluac worker reader failed: {e}")
+            process.kill()
+        process.wait()
+        # unluac calls System.exit() on some malformed input, taking every
+        # in-flight job down with it. Those are retried one JVM per file so
+        # the bad script cannot sink the others again.
+        with self.lock:
+            if process is not self.process:
+                return
+            orphaned = list(self.pending.values())
+            self.pending.clear()
+            # submit() runs files one JVM each until a new worker is up.
+            self.process = None
+            restart = not self.closing
+        if orphaned:
+            print(f"unluac worker exited with {process.returncode}, retrying {len(orphaned)} file(s) individually")
+        if restart:
+            try:
+                self.start()
+            except (OSError, RuntimeError) as e:
+                print(f"Could not restart unluac worker: {e}")
+        for entry in orphaned:
+            self._resolve(entry, decompile_one(self.unluac_path, entry[1], entry[2], self.java))
+
+
+def decompile_tree(unluac_path, input_dir, threads=None, java="java", on_result=None, cancel_event=None, files=None):
+    """Decompiles every .lua under input_dir to a .dec.lua next to it.
+
+    Returns a list of (input, output, error) tuples; error is None on success.
+    on_result, if given, is called as on_result(result, done, total) as each
+    file finishes. Setting cancel_event stops new files from being queued.
+    Falls back to one JVM per file when the worker cannot be started, e.g.
+    when only a JRE without the source launcher is installed. files, e.g.
+    from an AssetIndex query, replaces the walk of input_dir.
+    """
+    if files is None:
+        lua_files = find_lua_files(input_dir)
+    else:
+        lua_files = [path for path in files if is_compiled_lua(path)]
+    print(f"Found {len(lua_files)} .lua file(s) under {input_dir}")
+    if not lua_files:
+        return []
+    results = {}
+    lock = threading.Lock()
+
+    def finished(path, error):
+        with lock:
+            results[path] = (path, dec_output_path(path), error)
+            done = len(results)
+        if on_result is not None:
+            on_result(results[path], done, len(lua_files))
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    worker = UnluacWorker(unluac_path, java, threads)
+    try:
+        worker.start()
+    except (OSError, RuntimeError) as e:
+        print(f"Persistent unluac worker unavailable ({e}), using one JVM per file")
+        worker.close()
+
+        def decompile(path):
+            if not cancelled():
+                finished(path, decompile_one(unluac_path, path, dec_output_path(path), java))
+
+        with ThreadPoolExecutor(max_workers=worker.threads) as pool:
+            list(pool.map(decompile, lua_files))
+        return [results[path] for path in lua_files if path in results]
+    try:
+        for path in lua_files:
+            if cancelled():
+                break
+            worker.submit(path, dec_output_path(path)).add_done_callback(
+                lambda future, path=path: finished(path, future.result()))
+    finally:
+        worker.close()
+    return [results[path] for path in lua_files if path in results]
@@ -0,0 +1,74 @@
+"""Watches a workspace for saved scene sources.
+
+Editors save in bursts (a temp file, a rename, sometimes two writes), so a
+file is only reported once its size and mtime have stayed put for the
+debounce delay, and everything that settled in the same poll is reported
+together. Polling with scandir keeps this dependency-free and works the
+same on every platform; a poll of a mod workspace takes a few
+milliseconds.
+"""
+import os
+import time
+
+# Extension -> the encode a saved file needs.
+WATCHED = {".xml": "scene_enc", ".json": "oct encode"}
+POLL_INTERVAL = 0.2
+DEBOUNCE = 0.4
+
+
+def snapshot(root, extensions=tuple(WATCHED)):
+    """Returns {path: (size, mtime_ns)} for the watched files under root, skipping hidden folders."""
+    files = {}
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith("."):
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(extensions) and not entry.name.startswith("."):
+                    st = entry.stat()
+                    files[entry.path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+    return files
+
+
+class Watcher:
+    def __init__(self, root, interval=POLL_INTERVAL, debounce=DEBOUNCE, extensions=tuple(WATCHED)):
+        self.root = root
+        self.interval = interval
+        self.debounce = debounce
+        self.extensions = extensions
+        # Files already there when watching starts are not re-encoded.
+        self.files = snapshot(root, extensions)
+        self.pending = {}
+
+    def poll(self):
+        """Returns the files that changed and have since been quiet for the debounce delay."""
+        now = time.monotonic()
+        current = snapshot(self.root, self.extensions)
+        for path, state in current.items():
+            if self.files.get(path) != state:
+                self.pending[path] = now
+        self.files = current
+        settled = []
+        for path, changed in list(self.pending.items()):
+            if path not in current:
+                del self.pending[path]
+            elif now - changed >= self.debounce:
+                del self.pending[path]
+                settled.append(path)
+        return sorted(settled)
+
+    def watch(self, on_change, stop_event):
+        """Calls on_change(paths) for every settled batch until stop_event is set."""
+        while not stop_event.is_set():
+            paths = self.poll()
+            if paths:
+                on_change(paths)
+            stop_event.wait(self.interval)
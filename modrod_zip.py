@@ -0,0 +1,394 @@
+"""Native multithreaded .zip packer for the "Pack .zip" tab.
+
+Entries are deflated on a thread pool (zlib releases the GIL) and written
+to the archive in sorted name order, so the output is the same no matter
+which thread finishes first. Formats that are already compressed are
+stored as is, and anything deflate cannot shrink is stored as well.
+zipfile cannot write pre-compressed data, so ZipWriter emits the local
+headers, central directory and Zip64 records itself.
+"""
+import os
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+STORED = 0
+DEFLATED = 8
+CHUNK_SIZE = 1024 * 1024
+# Compressed entries above this are spooled to disk while they wait to be written.
+SPOOL_SIZE = 16 * 1024 * 1024
+# Store the entry if deflate saves less than this fraction.
+MIN_SAVING = 0.03
+# Formats that are already compressed, including the block-compressed
+# textures (.dds, .ktx, .pvr) the game ships; deflate cannot win on them.
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".webp", ".dds", ".tga", ".ktx", ".pvr",
+    ".ogg", ".mp3", ".xma", ".wma", ".fsb", ".bnk", ".bik", ".mp4",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar",
+}
+ZIP64_LIMIT = 0xFFFFFFFF
+UTF8_FLAG = 0x800
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def list_files(input_folder):
+    """Returns (arcname, path) pairs for every file under input_folder, sorted by arcname."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(input_folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files.append((os.path.relpath(path, input_folder).replace(os.sep, "/"), path))
+    files.sort()
+    return files
+
+
+class ZipEntry:
+    def __init__(self, name, method, crc, compress_size, file_size, mtime, mode=0o644):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.mtime = mtime
+        self.mode = mode
+        self.header_offset = 0
+
+
+class CompressedData:
+    """Output of compress_file(): the entry plus its data, in memory or spooled."""
+
+    def __init__(self, entry, spool):
+        self.entry = entry
+        self.spool = spool
+
+    def copy_to(self, fp):
+        self.spool.seek(0)
+        for chunk in iter(lambda: self.spool.read(CHUNK_SIZE), b""):
+            fp.write(chunk)
+        self.spool.close()
+
+
+def compress_file(arcname, path, level=6):
+    """Deflates (or stores) one file. Runs on a worker thread."""
+    st = os.stat(path)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    crc = 0
+    method = STORED if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS else DEFLATED
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == DEFLATED else None
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            spool.write(compressor.compress(chunk) if compressor else chunk)
+    if compressor is not None:
+        spool.write(compressor.flush())
+        if spool.tell() > size * (1 - MIN_SAVING):
+            method = STORED
+            spool.seek(0)
+            spool.truncate()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    spool.write(chunk)
+    entry = ZipEntry(arcname, method, crc, spool.tell(), size, st.st_mtime, st.st_mode & 0o777)
+    return CompressedData(entry, spool)
+
+
+class ZipWriter:
+    """Writes entries whose data is already compressed, then the central directory."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.entries = []
+
+    def _flags(self, entry):
+        return UTF8_FLAG if not entry.name.isascii() else 0
+
+    def write_entry(self, entry, copy_data):
+        """Writes entry's local header, then calls copy_data(fp) to write its data."""
+        entry.header_offset = self.fp.tell()
+        name = entry.name.encode("utf-8")
+        zip64 = entry.file_size >= ZIP64_LIMIT or entry.compress_size >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, entry.file_size, entry.compress_size) if zip64 else b""
+        dos_time, dos_date = dos_datetime(entry.mtime)
+        self.fp.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, self._flags(entry), entry.method, dos_time, dos_date,
+            entry.crc, ZIP64_LIMIT if zip64 else entry.compress_size, ZIP64_LIMIT if zip64 else entry.file_size,
+            len(name), len(extra)))
+        self.fp.write(name)
+        self.fp.write(extra)
+        copy_data(self.fp)
+        self.entries.append(entry)
+
+    def close(self):
+        """Writes the central directory, sorted by name, and the end records."""
+        start = self.fp.tell()
+        for entry in sorted(self.entries, key=lambda entry: entry.name):
+            name = entry.name.encode("utf-8")
+            zip64_fields = []
+            file_size, compress_size, offset = entry.file_size, entry.compress_size, entry.header_offset
+            if file_size >= ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = ZIP64_LIMIT
+            if compress_size >= ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields else 20
+            dos_time, dos_date = dos_datetime(entry.mtime)
+            self.fp.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, self._flags(entry), entry.method,
+                dos_time, dos_date, entry.crc, compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                (0o100000 | entry.mode) << 16, offset))
+            self.fp.write(name)
+            self.fp.write(extra)
+        end = self.fp.tell()
+        count, size = len(self.entries), end - start
+        if count >= 0xFFFF or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            self.fp.write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, size, start))
+            self.fp.write(struct.pack("<IIQI", 0x07064B50, 0, end, 1))
+            count, size, start = min(count, 0xFFFF), min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT)
+        self.fp.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, size, start, 0))
+
+
+def zip_datetime(timestamp):
+    """Returns timestamp the way ZipInfo.date_time reports it (2 second resolution)."""
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec // 2 * 2)
+
+
+def file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def local_data_offset(fp, header_offset):
+    fp.seek(header_offset)
+    header = fp.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local file header at offset {header_offset}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return header_offset + 30 + name_length + extra_length
+
+
+def _write_entries(writer, tasks, threads, level, progress=None, cancel_event=None):
+    """Writes tasks to writer in order and returns the number of bytes compressed.
+
+    A task is an (arcname, path) pair, compressed on the pool, a RawData
+    copied through unchanged, a Future that will yield CompressedData
+    (compress_file() run elsewhere), or a callable returning such a Future,
+    called only when the task is queued. At most twice as many compressed
+    entries as threads are held at once, so memory stays bounded however
+    large the folder is.
+    """
+    bytes_in = 0
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        def submit(task):
+            if callable(task):
+                task = task()
+            if isinstance(task, Future):
+                return task
+            if isinstance(task, RawData):
+                future = Future()
+                future.set_result(task)
+                return future
+            return pool.submit(compress_file, task[0], task[1], level)
+
+        pending = deque()
+        queued = iter(tasks)
+        try:
+            for task in queued:
+                pending.append(submit(task))
+                if len(pending) >= threads * 2:
+                    break
+            written = 0
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("packing cancelled")
+                data = pending.popleft().result()
+                for task in queued:
+                    pending.append(submit(task))
+                    break
+                writer.write_entry(data.entry, data.copy_to)
+                if isinstance(data, CompressedData):
+                    bytes_in += data.entry.file_size
+                written += 1
+                if progress is not None:
+                    progress(written, len(tasks))
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return bytes_in
+
+
+def _stats(start_time, output_zip, files, bytes_in, **extra):
+    seconds = time.perf_counter() - start_time
+    stats = {
+        "files": files,
+        "bytes_in": bytes_in,
+        "bytes_out": os.path.getsize(output_zip),
+        "seconds": seconds,
+        "mb_per_second": bytes_in / (1024 * 1024) / seconds if seconds else 0.0,
+        "mode": "full",
+    }
+    stats.update(extra)
+    return stats
+
+
+def _write_archive(temp_path, tasks, threads, level, progress, cancel_event):
+    """Builds a complete archive at temp_path, removing it again on failure."""
+    try:
+        with open(temp_path, "wb") as fp:
+            writer = ZipWriter(fp)
+            bytes_in = _write_entries(writer, tasks, threads, level, progress, cancel_event)
+            writer.close()
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return bytes_in
+
+
+def pack_entries(output_zip, tasks, threads=None, level=6, progress=None, cancel_event=None):
+    """Writes tasks (see _write_entries) to output_zip and returns throughput statistics."""
+    start_time = time.perf_counter()
+    bytes_in = _write_archive(output_zip + ".tmp", tasks, threads or os.cpu_count() or 1, level, progress,
+                              cancel_event)
+    os.replace(output_zip + ".tmp", output_zip)
+    return _stats(start_time, output_zip, len(tasks), bytes_in)
+
+
+def pack_folder(input_folder, output_zip, threads=None, level=6, progress=None, cancel_event=None):
+    """Packs input_folder into output_zip and returns throughput statistics."""
+    return pack_entries(output_zip, list_files(input_folder), threads, level, progress, cancel_event)
+
+
+class RawData:
+    """An entry copied byte for byte out of an existing archive."""
+
+    def __init__(self, entry, source, data_offset):
+        self.entry = entry
+        self.source = source
+        self.data_offset = data_offset
+
+    def copy_to(self, fp):
+        self.source.seek(self.data_offset)
+        remaining = self.entry.compress_size
+        while remaining:
+            chunk = self.source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"{self.entry.name} is truncated")
+            fp.write(chunk)
+            remaining -= len(chunk)
+
+
+def repack_folder(input_folder, output_zip, threads=None, level=6, progress=None, cancel_event=None,
+                  max_garbage=0.25):
+    """Brings an existing output_zip up to date with input_folder.
+
+    Files whose size and mtime match their entry, or whose CRC does when
+    the mtime moved or is newer than the archive, keep their compressed data untouched. Added and
+    modified files are compressed and appended after the existing data,
+    then a new central directory is written, so the cost follows the size
+    of the change. Superseded data is left behind as dead space; once that
+    exceeds max_garbage of the archive, the archive is rewritten instead,
+    copying unchanged entries raw rather than recompressing them.
+    """
+    if not os.path.exists(output_zip):
+        return pack_folder(input_folder, output_zip, threads, level, progress, cancel_event)
+    start_time = time.perf_counter()
+    threads = threads or os.cpu_count() or 1
+    files = list_files(input_folder)
+    try:
+        with zipfile.ZipFile(output_zip) as zf:
+            existing = {info.filename: info for info in zf.infolist()}
+    except zipfile.BadZipFile as e:
+        print(f"Cannot reuse {output_zip} ({e}), packing from scratch")
+        return pack_folder(input_folder, output_zip, threads, level, progress, cancel_event)
+    original_size = os.path.getsize(output_zip)
+    archive_mtime = os.path.getmtime(output_zip) - 2
+    kept = {}
+    touched = []
+    changed = []
+    with open(output_zip, "rb") as source:
+        for arcname, path in files:
+            info = existing.get(arcname)
+            st = os.stat(path)
+            if info is None or info.file_size != st.st_size or info.flag_bits & 0x1:
+                changed.append((arcname, path))
+                continue
+            # Zip times only resolve to 2 seconds, so a file written after the
+            # archive may still match its entry's time; check its CRC too.
+            retimed = info.date_time != zip_datetime(st.st_mtime)
+            if retimed or st.st_mtime >= archive_mtime:
+                if file_crc(path) != info.CRC:
+                    changed.append((arcname, path))
+                    continue
+            if retimed:
+                touched.append(arcname)
+            entry = ZipEntry(arcname, info.compress_type, info.CRC, info.compress_size, info.file_size, st.st_mtime,
+                             st.st_mode & 0o777)
+            entry.header_offset = info.header_offset
+            kept[arcname] = (entry, local_data_offset(source, info.header_offset))
+    names = {arcname for arcname, path in files}
+    deleted = sum(1 for name in existing if name not in names)
+    added = sum(1 for arcname, path in changed if arcname not in existing)
+    counts = {"unchanged": len(kept), "changed": len(changed) - added, "added": added, "deleted": deleted}
+    if not changed and not deleted and not touched:
+        return _stats(start_time, output_zip, len(files), 0, mode="unchanged", **counts)
+    live = sum(data_offset - entry.header_offset + entry.compress_size for entry, data_offset in kept.values())
+    if original_size - live > original_size * max_garbage:
+        with open(output_zip, "rb") as source:
+            tasks = [RawData(kept[arcname][0], source, kept[arcname][1]) if arcname in kept else (arcname, path)
+                     for arcname, path in files]
+            bytes_in = _write_archive(output_zip + ".tmp", tasks, threads, level, progress, cancel_event)
+        os.replace(output_zip + ".tmp", output_zip)
+        return _stats(start_time, output_zip, len(files), bytes_in, mode="compact", **counts)
+    with open(output_zip, "r+b") as fp:
+        try:
+            for arcname in touched:
+                entry = kept[arcname][0]
+                fp.seek(entry.header_offset + 10)
+                fp.write(struct.pack("<HH", *dos_datetime(entry.mtime)))
+            # Append after the old central directory so a failure can be
+            # undone by truncating back to the original archive.
+            fp.seek(0, os.SEEK_END)
+            writer = ZipWriter(fp)
+            writer.entries = [entry for entry, data_offset in kept.values()]
+            bytes_in = _write_entries(writer, changed, threads, level, progress, cancel_event)
+            writer.close()
+        except BaseException:
+            fp.truncate(original_size)
+            raise
+    return _stats(start_time, output_zip, len(files), bytes_in, mode="delta", **counts)
+
+
+def format_stats(stats):
+    summary = (f"Packed {stats['files']} files, {stats['bytes_in'] / (1024 * 1024):.1f} MB compressed -> "
+               f"{stats['bytes_out'] / (1024 * 1024):.1f} MB archive in {stats['seconds']:.2f}s "
+               f"({stats['mb_per_second']:.1f} MB/s)")
+    if stats["mode"] != "full":
+        summary += (f" [{stats['mode']}: {stats['unchanged']} unchanged, {stats['changed']} changed, "
+                    f"{stats['added']} added, {stats['deleted']} deleted]")
+    return summary
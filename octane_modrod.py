@@ -1,11 +1,18 @@
+import os
+import sys
+
+# Command line runs never need Tk, so dispatch them before importing it.
+if __name__ == "__main__" and len(sys.argv) > 1:
+    import modrod_cli
+    sys.exit(modrod_cli.main(sys.argv[1:]))
+
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import subprocess
-import os
-import sys
-import zipfile
-import requests
-import shutil
+import modrod_cache
+import modrod_jobs
+import modrod_ops
+import modrod_toolchain
 
 
 class Cars2ModdingTool:
@@ -20,51 +27,86 @@ class Cars2ModdingTool:
         self.output_text = None
         self.unluac_entry = None
         self.decrypt_input = None
+        self.decrypt_folder = None
         self.pack_name = None
+        self.pack_with_c2ditools = None
+        self.pack_incremental = None
+        self.build_recipe = None
         self.encode_input = None
         self.decode_input = None
+        self.decode_folder_input = None
+        self.decode_folder_output = None
+        self.jobs_tree = None
+        self.encode_folder_input = None
+        self.encode_folder_output = None
+        self.decode_folder_query = None
+        self.decode_dedupe_textures = None
+        self.encode_folder_query = None
+        self.decrypt_folder_query = None
         self.root = root
-        self.root.geometry("800x600")
+        self.root.geometry("800x720")
+        self.root.protocol("WM_DELETE_WINDOW", self.exit_app)
+        self.scheduler = modrod_jobs.JobScheduler()
+        self.pending_events = []
+        self.root.after(100, self.poll_jobs)
         self.unluac_path = ""
         self.offsetting_path = ""
+        self.build_cache = None
+        self.texture_store = None
+        self.toolchain = None
         self.load_config()
-        if not self.check_initial_setup():
+        # The window is built straight away from what config.txt says; the
+        # probes finish in the background and poll_toolchain() acts on them.
+        if not self.unluac_path:
             self.show_install_ui()
         else:
             self.show_main_ui()
+        self.root.after(100, self.poll_toolchain)
 
     def load_config(self):
         if os.path.exists("config.txt"):
-            with open("config.txt", "r") as f:
-                lines = f.readlines()
-                for line in lines:
-                    if line.startswith("unluac_path="):
-                        self.unluac_path = line.strip().split("=", 1)[1]
-                        print(f"Loaded unluac_path: {self.unluac_path}")
+            config = modrod_ops.read_config()
+            self.unluac_path = config.get("unluac_path", "")
+            self.offsetting_path = config.get("offsetting_path", "")
+            print(f"Loaded unluac_path: {self.unluac_path}, offsetting_path: {self.offsetting_path}")
         else:
+            config = {}
             print("No config.txt found, starting fresh setup")
+        # Probe the tools in the background while the UI is built.
+        self.toolchain = modrod_toolchain.Toolchain(config, on_change=self.save_toolchain)
+        self.toolchain.start()
 
     def save_config(self):
-        with open("config.txt", "w") as f:
-            f.write(f"unluac_path={self.unluac_path}\n")
-            f.write(f"offsetting_path={self.offsetting_path}\n")
-            print(f"Saved config: unluac_path={self.unluac_path}, offsetting_path={self.offsetting_path}")
+        modrod_ops.write_config({"unluac_path": self.unluac_path, "offsetting_path": self.offsetting_path})
+        print(f"Saved config: unluac_path={self.unluac_path}, offsetting_path={self.offsetting_path}")
+        self.toolchain.configure(unluac=self.unluac_path, offsetting=self.offsetting_path)
+
+    def save_toolchain(self, status):
+        """Called from a probe thread whenever a tool's path or version changed."""
+        print(f"Probed {status.name}: {status.path or 'not found'} {status.version}")
+        modrod_ops.write_config(self.toolchain.to_config())
 
     def check_initial_setup(self):
-        try:
-            import c2ditools
-            print("c2ditools module found")
-            unluac_exists = os.path.exists(self.unluac_path)
-            print(f"Checking unluac_path: {self.unluac_path} exists={unluac_exists}")
-            return unluac_exists and "c2ditools" in sys.modules
-        except ImportError:
-            print("c2ditools module not found")
-            return False
+        c2ditools_found = self.toolchain.available("c2ditools")
+        print(f"c2ditools module found={c2ditools_found}")
+        unluac_exists = self.toolchain.available("unluac")
+        print(f"Checking unluac_path: {self.unluac_path} exists={unluac_exists}")
+        return c2ditools_found and unluac_exists
+
+    def poll_toolchain(self):
+        if not self.toolchain.done(("c2ditools", "unluac")):
+            self.root.after(100, self.poll_toolchain)
+            return
+        if self.check_initial_setup() or self.notebook is None:
+            return
+        messagebox.showwarning("Setup", "c2ditools or unluac.jar could not be found. Please finish the setup.")
+        self.show_install_ui()
 
     def show_install_ui(self):
         self.root.title("Cars 2 Modding Tool - Setup")
         for widget in self.root.winfo_children():
             widget.destroy()
+        self.notebook = None
         tk.Label(self.root, text="Welcome! Let's set up the modding tools.", font=("Arial", 14)).pack(pady=20)
         tk.Label(self.root, text="Select unluac.jar location:").pack(pady=5)
         self.unluac_entry = tk.Entry(self.root, width=50)
@@ -94,12 +136,10 @@ class Cars2ModdingTool:
         jar_filename = "unluac.jar"
         print(f"Starting download of unluac.jar from {url}")
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            import modrod_download
             script_dir = os.path.dirname(os.path.abspath(__file__))
             dest_path = os.path.join(script_dir, jar_filename)
-            with open(dest_path, "wb") as f:
-                f.write(response.content)
+            modrod_download.download(url, dest_path)
             self.unluac_entry.delete(0, tk.END)
             self.unluac_entry.insert(0, dest_path)
             print(f"Downloaded and placed unluac.jar at {dest_path}")
@@ -115,6 +155,7 @@ class Cars2ModdingTool:
             result = subprocess.run([sys.executable, "-m", "pip", "install", "git+https://github.com/TKFRvisionOfficial/Cars2TheVideoGameModding.git"],
                                     capture_output=True, text=True)
             if result.returncode == 0:
+                self.toolchain.start(["c2ditools"])
                 messagebox.showinfo("Success", "c2ditools installed successfully!")
                 print("c2ditools installed successfully")
             else:
@@ -128,10 +169,8 @@ class Cars2ModdingTool:
         url = "https://github.com/offsetting/offsetting/releases/latest/download/offsetting_windows.exe"
         exe_path = os.path.join(os.getcwd(), "offsetting_windows.exe")
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            with open(exe_path, "wb") as f:
-                f.write(response.content)
+            import modrod_download
+            modrod_download.download(url, exe_path)
             self.offsetting_path = exe_path
             self.save_config()
             messagebox.showinfo("Success", "Offsetting installed successfully!")
@@ -145,10 +184,11 @@ class Cars2ModdingTool:
             messagebox.showerror("Error", "Please select or install a valid unluac.jar file.")
             print(f"Invalid unluac_path: {self.unluac_path} does not exist")
             return
-        try:
-            import c2ditools
-            print("c2ditools import successful")
-        except ImportError:
+        if not self.toolchain.done(("c2ditools",)):
+            messagebox.showinfo("Setup", "Still checking for c2ditools, please try again in a moment.")
+            print("c2ditools probe still running")
+            return
+        if not self.toolchain.available("c2ditools"):
             messagebox.showerror("Error", "c2ditools is not installed. Please click 'Install c2ditools' first.")
             print("c2ditools not installed")
             return
@@ -173,30 +213,59 @@ class Cars2ModdingTool:
             "Pack .zip": ttk.Frame(self.notebook),
             "Decrypt .lua": ttk.Frame(self.notebook),
             "Offsetting Decode": ttk.Frame(self.notebook),
-            "Offsetting Encode": ttk.Frame(self.notebook)
+            "Offsetting Encode": ttk.Frame(self.notebook),
+            "Build": ttk.Frame(self.notebook),
+            "Watch": ttk.Frame(self.notebook)
         }
         for tab_name, tab_frame in self.tabs.items():
             self.notebook.add(tab_frame, text=tab_name)
+        jobs_frame = ttk.Frame(self.root)
+        jobs_frame.pack(pady=5)
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=("status", "progress"), height=4)
+        self.jobs_tree.heading("#0", text="Job")
+        self.jobs_tree.heading("status", text="Status")
+        self.jobs_tree.heading("progress", text="Progress")
+        self.jobs_tree.column("#0", width=420)
+        self.jobs_tree.column("status", width=100)
+        self.jobs_tree.column("progress", width=100)
+        self.jobs_tree.pack(side=tk.LEFT)
+        ttk.Button(jobs_frame, text="Cancel Job", command=self.cancel_selected_job).pack(side=tk.LEFT, padx=5)
+        for job in self.scheduler.jobs.values():
+            self.update_job_row(job)
         self.output_text = tk.Text(self.root, height=10, width=80)
         self.output_text.pack(pady=10)
         button_frame = ttk.Frame(self.root)
         button_frame.pack(pady=5)
         ttk.Button(button_frame, text="Check Dependencies", command=self.check_dependencies).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Job Stats", command=self.show_stats).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Clear Output", command=self.clear_output).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Restart Setup", command=self.restart_setup).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="Exit", command=self.root.quit).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Exit", command=self.exit_app).pack(side=tk.LEFT, padx=5)
         self.setup_decode_tab()
         self.setup_encode_tab()
         self.setup_pack_zip_tab()
         self.setup_lua_decrypt_tab()
         self.setup_offsetting_decode_tab()
         self.setup_offsetting_encode_tab()
+        self.setup_build_tab()
+        self.setup_watch_tab()
         print("Main UI displayed")
 
     def clear_output(self):
         self.output_text.delete(1.0, tk.END)
         print("Output cleared")
 
+    def show_stats(self):
+        import modrod_trace
+        tracer = modrod_trace.get_tracer()
+        records = tracer.read()
+        if not records:
+            self.output_text.insert(tk.END, f"No jobs traced yet in {tracer.path}\n")
+            return
+        self.output_text.insert(tk.END, modrod_trace.format_summary(modrod_trace.summarize(records)) + "\n")
+        self.output_text.see(tk.END)
+        print("Job stats displayed")
+
     def browse_file(self, entry, filetypes=[("All files", "*.*")]):
         filename = filedialog.askopenfilename(filetypes=filetypes)
         if filename:
@@ -211,44 +280,98 @@ class Cars2ModdingTool:
             entry.insert(0, directory)
             print(f"Browsed and selected directory: {directory}")
 
-    def run_command(self, command, shell=False):
-        print(f"Running command: {' '.join(command) if not shell else command}")
-        try:
-            print(f"Running command: {command}")
-            result = subprocess.run(command, capture_output=True, text=True, shell=True)
-            if result.returncode != 0:
-                messagebox.showerror("Error", f"Command failed:\n{result.stderr}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Execution failed: {str(e)}")
+    def start_job(self, name, fn):
+        """Queues fn(job) on the scheduler; its output streams into output_text."""
+        job = self.scheduler.submit(name, fn)
+        print(f"Queued job {job.id}: {name}")
+        return job
+
+    def poll_jobs(self):
+        ui_ready = self.output_text is not None and self.output_text.winfo_exists()
+        events = self.pending_events + self.scheduler.poll()
+        if not ui_ready:
+            # Kept for the main UI, e.g. the log of a job started from the setup screen.
+            self.pending_events = events
+            self.root.after(100, self.poll_jobs)
+            return
+        self.pending_events = []
+        for kind, job, text in events:
+            if kind == "output":
+                self.output_text.insert(tk.END, text)
+                self.output_text.see(tk.END)
+            else:
+                self.update_job_row(job)
+                if kind == "status" and text == modrod_jobs.FAILED:
+                    messagebox.showerror("Error", f"{job.name} failed. See output for details.")
+        self.root.after(100, self.poll_jobs)
+
+    def update_job_row(self, job):
+        values = (job.status, job.progress)
+        if self.jobs_tree.exists(str(job.id)):
+            self.jobs_tree.item(str(job.id), values=values)
+        else:
+            self.jobs_tree.insert("", 0, iid=str(job.id), text=job.name, values=values)
+
+    def cancel_selected_job(self):
+        for item in self.jobs_tree.selection():
+            self.scheduler.cancel(int(item))
+
+    def exit_app(self):
+        self.scheduler.shutdown()
+        self.root.quit()
+
+    def get_build_cache(self):
+        if self.build_cache is None:
+            self.build_cache = modrod_cache.BuildCache()
+        return self.build_cache
+
+    def get_texture_store(self):
+        """Returns the shared TextureStore if "Dedupe textures" is ticked, else None."""
+        if not self.decode_dedupe_textures.get():
+            return None
+        if self.texture_store is None:
+            import modrod_textures
+            self.texture_store = modrod_textures.TextureStore()
+        return self.texture_store
 
     def check_dependencies(self):
         self.clear_output()
-        messages = []
         print("Checking dependencies")
-        try:
-            import c2ditools
-            self.output_text.insert(tk.END, "c2ditools: Installed\n")
+        # The probes run in the background; show_dependencies() waits for
+        # them with after() so the window stays responsive.
+        self.toolchain.refresh()
+        self.root.after(100, self.show_dependencies)
+
+    def show_dependencies(self):
+        if self.notebook is None:
+            return
+        if not self.toolchain.done():
+            self.root.after(100, self.show_dependencies)
+            return
+        tools = {name: self.toolchain.get(name) for name in modrod_toolchain.TOOLS}
+        messages = []
+        if tools["c2ditools"].found:
+            self.output_text.insert(tk.END, f"c2ditools: Installed ({tools['c2ditools'].version})\n")
             print("c2ditools check: Installed")
-        except ImportError:
+        else:
             messages.append("c2ditools is missing. Install it from the setup screen.")
             self.output_text.insert(tk.END, "c2ditools: Not installed\n")
             print("c2ditools check: Not installed")
-        try:
-            subprocess.run(["java", "-version"], capture_output=True, text=True, check=True)
-            self.output_text.insert(tk.END, "Java: Installed\n")
+        if tools["java"].found:
+            self.output_text.insert(tk.END, f"Java: Installed ({tools['java'].version})\n")
             print("Java check: Installed")
-        except subprocess.CalledProcessError:
+        else:
             messages.append("Java is missing. Install Java to use Unluac for .lua decryption.")
             self.output_text.insert(tk.END, "Java: Not installed\n")
             print("Java check: Not installed")
-        if os.path.exists(self.unluac_path):
+        if tools["unluac"].found:
             self.output_text.insert(tk.END, f"unluac.jar: Found at {self.unluac_path}\n")
             print(f"unluac.jar check: Found at {self.unluac_path}")
         else:
             messages.append("unluac.jar location is invalid. Re-run setup.")
             self.output_text.insert(tk.END, f"unluac.jar: Not found at {self.unluac_path}\n")
             print(f"unluac.jar check: Not found at {self.unluac_path}")
-        if os.path.exists(self.offsetting_path):
+        if tools["offsetting"].found:
             self.output_text.insert(tk.END, f"offsetting: Found at {self.offsetting_path}\n")
             print(f"offsetting: Found at {self.offsetting_path}")
         else:
@@ -276,17 +399,34 @@ class Cars2ModdingTool:
         self.decode_textures = tk.Entry(frame, width=50)
         self.decode_textures.grid(row=2, column=1, padx=5, pady=5)
         ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.decode_textures)).grid(row=2, column=2, padx=5)
+        self.decode_dedupe_textures = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Dedupe textures",
+                        variable=self.decode_dedupe_textures).grid(row=3, column=0, padx=5, pady=5)
         ttk.Button(frame, text="Decode", command=self.decode_oct).grid(row=3, column=1, pady=10)
+        tk.Label(frame, text="Input Folder:").grid(row=4, column=0, padx=5, pady=5)
+        self.decode_folder_input = tk.Entry(frame, width=50)
+        self.decode_folder_input.grid(row=4, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.decode_folder_input)).grid(row=4, column=2, padx=5)
+        tk.Label(frame, text="Output Folder:").grid(row=5, column=0, padx=5, pady=5)
+        self.decode_folder_output = tk.Entry(frame, width=50)
+        self.decode_folder_output.grid(row=5, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.decode_folder_output)).grid(row=5, column=2, padx=5)
+        tk.Label(frame, text="Index Filter:").grid(row=6, column=0, padx=5, pady=5)
+        self.decode_folder_query = tk.Entry(frame, width=50)
+        self.decode_folder_query.grid(row=6, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Index Folder",
+                   command=lambda: self.index_folder(self.decode_folder_input.get())).grid(row=6, column=2, padx=5)
+        ttk.Button(frame, text="Decode Folder", command=self.decode_oct_folder).grid(row=7, column=1, pady=10)
         print("Decode tab setup completed")
 
     def decode_oct(self):
         print("Starting decode operation")
-        try:
-            import c2ditools
-            command = ["python", "-m", "c2ditools", "scene_dec", self.decode_input.get(), self.decode_output.get(), "-t", self.decode_textures.get()]
-            self.run_command(command)
-            print("Decode operation completed")
-        except ImportError:
+        if self.toolchain.available("c2ditools"):
+            args = (self.decode_input.get(), self.decode_output.get(), self.decode_textures.get(),
+                    self.get_texture_store())
+            self.start_job(f"Decode {os.path.basename(args[0])}", lambda job: modrod_ops.scene_decode(job, *args))
+            print("Decode operation queued")
+        else:
             messagebox.showerror("Error", "c2ditools is not installed. Check setup.")
             self.output_text.insert(tk.END, "c2ditools not installed for decode\n")
             print("Decode failed: c2ditools not installed")
@@ -306,20 +446,66 @@ class Cars2ModdingTool:
         self.encode_textures.grid(row=2, column=1, padx=5, pady=5)
         ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.encode_textures)).grid(row=2, column=2, padx=5)
         ttk.Button(frame, text="Encode", command=self.encode_xml).grid(row=3, column=1, pady=10)
+        tk.Label(frame, text="Input Folder:").grid(row=4, column=0, padx=5, pady=5)
+        self.encode_folder_input = tk.Entry(frame, width=50)
+        self.encode_folder_input.grid(row=4, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.encode_folder_input)).grid(row=4, column=2, padx=5)
+        tk.Label(frame, text="Output Folder:").grid(row=5, column=0, padx=5, pady=5)
+        self.encode_folder_output = tk.Entry(frame, width=50)
+        self.encode_folder_output.grid(row=5, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.encode_folder_output)).grid(row=5, column=2, padx=5)
+        tk.Label(frame, text="Index Filter:").grid(row=6, column=0, padx=5, pady=5)
+        self.encode_folder_query = tk.Entry(frame, width=50)
+        self.encode_folder_query.grid(row=6, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Index Folder",
+                   command=lambda: self.index_folder(self.encode_folder_input.get())).grid(row=6, column=2, padx=5)
+        ttk.Button(frame, text="Encode Folder", command=self.encode_xml_folder).grid(row=7, column=1, pady=10)
         print("Encode tab setup completed")
 
     def encode_xml(self):
         print("Starting encode operation")
-        try:
-            import c2ditools
-            command = ["python", "-m", "c2ditools", "scene_enc", self.encode_input.get(), self.encode_output.get(), "-t", self.encode_textures.get()]
-            self.run_command(command)
-            print("Encode operation completed")
-        except ImportError:
+        if self.toolchain.available("c2ditools"):
+            input_path = self.encode_input.get()
+            output_path = self.encode_output.get()
+            textures_dir = self.encode_textures.get()
+            cache = self.get_build_cache()
+            self.start_job(f"Encode {os.path.basename(input_path)}", lambda job: modrod_ops.scene_encode(
+                job, input_path, output_path, textures_dir, cache))
+            print("Encode operation queued")
+        else:
             messagebox.showerror("Error", "c2ditools is not installed. Check setup.")
             self.output_text.insert(tk.END, "c2ditools not installed for encode\n")
             print("Encode failed: c2ditools not installed")
 
+    def run_scene_folder(self, mode, input_folder, output_folder, textures_dir, query):
+        if not os.path.isdir(input_folder):
+            messagebox.showerror("Error", "Please select an input folder.")
+            return
+        if not output_folder:
+            messagebox.showerror("Error", "Please select an output folder.")
+            return
+        cache = self.get_build_cache()
+        texture_store = self.get_texture_store() if mode == "scene_dec" else None
+        verb = "Decode" if mode == "scene_dec" else "Encode"
+        self.start_job(f"{verb} folder {input_folder}", lambda job: modrod_ops.scene_folder(
+            job, mode, input_folder, output_folder, textures_dir, cache, query, texture_store))
+
+    def decode_oct_folder(self):
+        print("Starting batch decode operation")
+        self.run_scene_folder("scene_dec", self.decode_folder_input.get(), self.decode_folder_output.get(),
+                              self.decode_textures.get(), self.decode_folder_query.get().strip())
+
+    def encode_xml_folder(self):
+        print("Starting batch encode operation")
+        self.run_scene_folder("scene_enc", self.encode_folder_input.get(), self.encode_folder_output.get(),
+                              self.encode_textures.get(), self.encode_folder_query.get().strip())
+
+    def index_folder(self, folder):
+        if not os.path.isdir(folder):
+            messagebox.showerror("Error", "Please select an input folder.")
+            return
+        self.start_job(f"Index {folder}", lambda job: modrod_ops.index_scan(job, folder))
+
     def setup_offsetting_decode_tab(self):
         frame = self.tabs["Offsetting Decode"]
         tk.Label(frame, text="Input OCT File:").grid(row=0, column=0, padx=5, pady=5)
@@ -328,16 +514,71 @@ class Cars2ModdingTool:
         ttk.Button(frame, text="Browse",
                    command=lambda: self.browse_file(self.decode_input, [("OCT files", "*.oct")])).grid(row=0, column=2)
         ttk.Button(frame, text="Decode", command=self.offsetting_decode_oct).grid(row=1, column=1, pady=10)
+        tk.Label(frame, text="DCT Archive or Folder:").grid(row=2, column=0, padx=5, pady=5)
+        self.dct_input = tk.Entry(frame, width=50)
+        self.dct_input.grid(row=2, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse",
+                   command=lambda: self.browse_file(self.dct_input, [("DCT archives", "*.dct")])).grid(row=2, column=2)
+        ttk.Button(frame, text="Folder", command=lambda: self.browse_directory(self.dct_input)).grid(row=2, column=3)
+        tk.Label(frame, text="Output Folder:").grid(row=3, column=0, padx=5, pady=5)
+        self.dct_output = tk.Entry(frame, width=50)
+        self.dct_output.grid(row=3, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.dct_output)).grid(row=3, column=2)
+        tk.Label(frame, text="Only (globs):").grid(row=4, column=0, padx=5, pady=5)
+        self.dct_only = tk.Entry(frame, width=50)
+        self.dct_only.grid(row=4, column=1, padx=5, pady=5)
+        self.dct_decode = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Decode extracted .oct files",
+                        variable=self.dct_decode).grid(row=5, column=1, padx=5, pady=5)
+        self.dct_decrypt = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Decrypt extracted .lua files",
+                        variable=self.dct_decrypt).grid(row=6, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Unpack .dct", command=self.offsetting_unpack_dct).grid(row=7, column=1, pady=10)
+        ttk.Button(frame, text="Pack .dct", command=self.offsetting_pack_dct).grid(row=7, column=2, pady=10)
 
     def offsetting_decode_oct(self):
         input_path = self.decode_input.get()
-        output_path = input_path.replace(".oct", ".json")
-        command = [self.offsetting_path, "oct", "decode", "-t", input_path, output_path]
-        self.run_command(command)
+        offsetting_path = self.offsetting_path
+        self.start_job(f"Offsetting decode {os.path.basename(input_path)}",
+                       lambda job: modrod_ops.offsetting_decode(job, offsetting_path, input_path))
+
+    def dct_paths(self):
+        input_path = self.dct_input.get()
+        output_folder = self.dct_output.get()
+        if not os.path.exists(input_path):
+            messagebox.showerror("Error", "Please select a .dct archive or folder.")
+            return None
+        if not output_folder:
+            messagebox.showerror("Error", "Please select an output folder.")
+            return None
+        if not os.path.exists(self.offsetting_path):
+            messagebox.showerror("Error", f"Offsetting not found at {self.offsetting_path}. Check setup.")
+            return None
+        return input_path, output_folder
+
+    def offsetting_unpack_dct(self):
+        paths = self.dct_paths()
+        if paths is None:
+            return
+        input_path, output_folder = paths
+        patterns = self.dct_only.get().replace(",", " ").split() or None
+        decode = self.dct_decode.get()
+        unluac_path = self.unluac_path if self.dct_decrypt.get() else None
+        if unluac_path and not os.path.exists(unluac_path):
+            messagebox.showerror("Error", f"unluac.jar not found at {unluac_path}")
+            return
+        offsetting_path = self.offsetting_path
+        self.start_job(f"Unpack {os.path.basename(input_path)}", lambda job: modrod_ops.dct_unpack(
+            job, offsetting_path, input_path, output_folder, patterns, decode, unluac_path))
 
-    # def offsetting_indctive(self):
-    #     input_path = self.decode_input.get()
-    #     command = [self.offsetting_path, "dct", "unpack", self.decode_input.get(), self.decode_output.get()]
+    def offsetting_pack_dct(self):
+        paths = self.dct_paths()
+        if paths is None:
+            return
+        input_path, output_folder = paths
+        offsetting_path = self.offsetting_path
+        self.start_job(f"Pack {os.path.basename(input_path)}", lambda job: modrod_ops.dct_pack(
+            job, offsetting_path, input_path, output_folder))
 
 
     def setup_offsetting_encode_tab(self):
@@ -352,9 +593,10 @@ class Cars2ModdingTool:
 
     def encode_json(self):
         input_path = self.encode_input.get()
-        output_path = input_path.replace(".json", ".oct")
-        command = [self.offsetting_path, "oct", "encode", "-t", input_path, output_path]
-        self.run_command(command)
+        offsetting_path = self.offsetting_path
+        cache = self.get_build_cache()
+        self.start_job(f"Offsetting encode {os.path.basename(input_path)}",
+                       lambda job: modrod_ops.offsetting_encode(job, offsetting_path, input_path, cache=cache))
 
 # New zip packing method
     def setup_pack_zip_tab(self):
@@ -368,7 +610,14 @@ class Cars2ModdingTool:
         self.pack_folder.grid(row=1, column=1, padx=5, pady=5)
         ttk.Button(frame, text="Browse", command=self.browse_folder).grid(row=1, column=2, padx=5)
 
-        ttk.Button(frame, text="Pack .zip", command=self.execute_pack_zip).grid(row=2, column=1, pady=10)
+        self.pack_with_c2ditools = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Pack with c2ditools instead of the native packer",
+                        variable=self.pack_with_c2ditools).grid(row=2, column=1, padx=5, pady=5)
+        self.pack_incremental = tk.BooleanVar(value=True)
+        ttk.Checkbutton(frame, text="Only repack changed files",
+                        variable=self.pack_incremental).grid(row=3, column=1, padx=5, pady=5)
+
+        ttk.Button(frame, text="Pack .zip", command=self.execute_pack_zip).grid(row=4, column=1, pady=10)
         print("Pack .zip tab setup completed")
 
     def browse_folder(self):
@@ -390,22 +639,75 @@ class Cars2ModdingTool:
             return
 
         output_zip = f"{output_file}.zip"
-
-        try:
-            command = ["python", "-m", "c2ditools", "why", input_folder, output_zip]
-            subprocess.run(command, check=True)
-            messagebox.showinfo("Success", f"Packed {output_zip} successfully.")
-            print(".zip packing operation completed")
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Error", f"Failed to pack zip: {e}")
-            print(f".zip packing failed: {e}")
-        except FileNotFoundError:
-            messagebox.showerror("Error", "c2ditools is not installed or not found.")
-            print(".zip packing failed: c2ditools not found")
+        use_c2ditools = self.pack_with_c2ditools.get()
+        incremental = self.pack_incremental.get()
+        self.start_job(f"Pack {output_zip}",
+                       lambda job: modrod_ops.pack_zip(job, input_folder, output_zip, use_c2ditools, incremental))
 
 # end of c2ditools .zip packing functions
 # -----------------------------------------------------------------------------------------------------
 
+    def setup_build_tab(self):
+        frame = self.tabs["Build"]
+        tk.Label(frame, text="Build Recipe:").grid(row=0, column=0, padx=5, pady=5)
+        self.build_recipe = tk.Entry(frame, width=50)
+        self.build_recipe.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse",
+                   command=lambda: self.browse_file(self.build_recipe, [("Build recipes", "*.json")])).grid(row=0, column=2, padx=5)
+        ttk.Button(frame, text="Build Mod", command=self.build_mod).grid(row=1, column=1, pady=10)
+        print("Build tab setup completed")
+
+    def build_mod(self):
+        recipe_path = self.build_recipe.get()
+        if not os.path.isfile(recipe_path):
+            messagebox.showerror("Error", "Please select a build recipe.")
+            return
+        offsetting_path = self.offsetting_path
+        self.start_job(f"Build {os.path.basename(recipe_path)}",
+                       lambda job: modrod_ops.build_recipe(job, recipe_path, offsetting_path))
+
+    def setup_watch_tab(self):
+        frame = self.tabs["Watch"]
+        tk.Label(frame, text="Workspace Folder:").grid(row=0, column=0, padx=5, pady=5)
+        self.watch_workspace = tk.Entry(frame, width=50)
+        self.watch_workspace.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.watch_workspace)).grid(row=0, column=2, padx=5)
+        tk.Label(frame, text="Textures Directory:").grid(row=1, column=0, padx=5, pady=5)
+        self.watch_textures = tk.Entry(frame, width=50)
+        self.watch_textures.grid(row=1, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.watch_textures)).grid(row=1, column=2, padx=5)
+        self.watch_repack = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Repack .zip after each change",
+                        variable=self.watch_repack).grid(row=2, column=1, padx=5, pady=5)
+        tk.Label(frame, text="Output name:").grid(row=3, column=0, padx=5, pady=5)
+        self.watch_zip_name = tk.Entry(frame, width=50)
+        self.watch_zip_name.grid(row=3, column=1, padx=5, pady=5)
+        tk.Label(frame, text="Pack Folder:").grid(row=4, column=0, padx=5, pady=5)
+        self.watch_pack_folder = tk.Entry(frame, width=50)
+        self.watch_pack_folder.grid(row=4, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.watch_pack_folder)).grid(row=4, column=2, padx=5)
+        ttk.Button(frame, text="Start Watching", command=self.start_watch).grid(row=5, column=1, pady=10)
+        print("Watch tab setup completed")
+
+    def start_watch(self):
+        workspace = self.watch_workspace.get()
+        if not os.path.isdir(workspace):
+            messagebox.showerror("Error", "Please select a workspace folder.")
+            return
+        output_zip = None
+        if self.watch_repack.get():
+            if not self.watch_zip_name.get().strip():
+                messagebox.showerror("Error", "Please enter a name for the output file.")
+                return
+            output_zip = f"{self.watch_zip_name.get().strip()}.zip"
+        textures_dir = self.watch_textures.get() or None
+        pack_folder = self.watch_pack_folder.get() or None
+        offsetting_path = self.offsetting_path
+        cache = self.get_build_cache()
+        # Runs until cancelled from the jobs list.
+        self.start_job(f"Watch {workspace}", lambda job: modrod_ops.watch_workspace(
+            job, workspace, offsetting_path, None, textures_dir, cache, output_zip, pack_folder))
+
     def setup_lua_decrypt_tab(self):
         frame = self.tabs["Decrypt .lua"]
         tk.Label(frame, text="Input .lua File:").grid(row=0, column=0, padx=5, pady=5)
@@ -413,8 +715,31 @@ class Cars2ModdingTool:
         self.decrypt_input.grid(row=0, column=1, padx=5, pady=5)
         ttk.Button(frame, text="Browse", command=lambda: self.browse_file(self.decrypt_input, [("LUA files", "*.lua")])).grid(row=0, column=2, padx=5)
         ttk.Button(frame, text="Decrypt .lua", command=self.decrypt_lua).grid(row=1, column=1, pady=10)
+        tk.Label(frame, text="Input Folder:").grid(row=2, column=0, padx=5, pady=5)
+        self.decrypt_folder = tk.Entry(frame, width=50)
+        self.decrypt_folder.grid(row=2, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Browse", command=lambda: self.browse_directory(self.decrypt_folder)).grid(row=2, column=2, padx=5)
+        tk.Label(frame, text="Index Filter:").grid(row=3, column=0, padx=5, pady=5)
+        self.decrypt_folder_query = tk.Entry(frame, width=50)
+        self.decrypt_folder_query.grid(row=3, column=1, padx=5, pady=5)
+        ttk.Button(frame, text="Index Folder",
+                   command=lambda: self.index_folder(self.decrypt_folder.get())).grid(row=3, column=2, padx=5)
+        ttk.Button(frame, text="Decrypt Folder", command=self.decrypt_lua_folder).grid(row=4, column=1, pady=10)
+        tk.Label(frame, text="Search Scripts:").grid(row=5, column=0, padx=5, pady=5)
+        self.lua_search_query = tk.Entry(frame, width=50)
+        self.lua_search_query.grid(row=5, column=1, padx=5, pady=5)
+        self.lua_search_query.bind("<Return>", lambda event: self.search_lua())
+        ttk.Button(frame, text="Search", command=self.search_lua).grid(row=5, column=2, padx=5)
         print(".lua Decryption tab setup completed")
 
+    def search_lua(self):
+        query = self.lua_search_query.get().strip()
+        if not query:
+            messagebox.showerror("Error", "Please enter something to search for, e.g. fn:update.")
+            return
+        root = self.decrypt_folder.get() or None
+        self.start_job(f"Search scripts for {query}", lambda job: modrod_ops.lua_search(job, query, root))
+
     def decrypt_lua(self):
         print("Starting .lua decryption operation")
         if not os.path.exists(self.unluac_path):
@@ -423,37 +748,22 @@ class Cars2ModdingTool:
             print(f"LUA decrypt failed: unluac.jar not found at {self.unluac_path}")
             return
         input_lua = self.decrypt_input.get()
-        lua_dir = os.path.dirname(input_lua)
-        base_name = os.path.splitext(os.path.basename(input_lua))[0]
-        output_lua = os.path.join(lua_dir, f"{base_name}.dec.lua")
-        temp_unluac_path = os.path.join(lua_dir, "unluac.jar")
-        original_unluac_path = self.unluac_path
-        print(f"Copying unluac.jar from {self.unluac_path} to {temp_unluac_path}")
-        try:
-            shutil.copy2(self.unluac_path, temp_unluac_path)
-            self.output_text.insert(tk.END, f"Copied unluac.jar to {temp_unluac_path}\n")
-            self.unluac_path = temp_unluac_path
-            print(f"Temporarily set unluac_path to {self.unluac_path}")
-            self.output_text.insert(tk.END, f"Output will be saved to {output_lua}\n")
-            print(f"Output will be saved to {output_lua}")
-            command = ["java", "-jar", self.unluac_path, input_lua, ">", output_lua]
-            self.run_command(command, shell=True)
-            print(".lua decryption operation completed")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed during LUA decryption: {str(e)}")
-            self.output_text.insert(tk.END, f"Decryption error: {str(e)}\n")
-            print(f".lua decryption failed: {str(e)}")
-        finally:
-            self.unluac_path = original_unluac_path
-            print(f"Reverted unluac_path to {self.unluac_path}")
-            if os.path.exists(temp_unluac_path):
-                os.remove(temp_unluac_path)
-                self.output_text.insert(tk.END, f"Removed temporary unluac.jar from {temp_unluac_path}\n")
-                print(f"Removed temporary unluac.jar from {temp_unluac_path}")
-            else:
-                print(f"Temporary unluac.jar not found at {temp_unluac_path}, no removal needed")
+        unluac_path = self.unluac_path
+        self.start_job(f"Decrypt {os.path.basename(input_lua)}",
+                       lambda job: modrod_ops.decrypt_lua(job, unluac_path, input_lua))
 
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = Cars2ModdingTool(root)
-    root.mainloop()
\ No newline at end of file
+    def decrypt_lua_folder(self):
+        print("Starting batch .lua decryption operation")
+        if not os.path.exists(self.unluac_path):
+            messagebox.showerror("Error", "unluac.jar path is invalid. Re-run setup.")
+            self.output_text.insert(tk.END, f"unluac.jar not found at {self.unluac_path}\n")
+            print(f"Batch LUA decrypt failed: unluac.jar not found at {self.unluac_path}")
+            return
+        input_folder = self.decrypt_folder.get()
+        if not os.path.isdir(input_folder):
+            messagebox.showerror("Error", "Please select an input folder.")
+            return
+        unluac_path = self.unluac_path
+        query = self.decrypt_folder_query.get().strip()
+        self.start_job(f"Decrypt folder {input_folder}",
+                       lambda job: modrod_ops.decrypt_lua_folder(job, unluac_path, input_folder, query))